@@ -1,8 +1,50 @@
 #!/usr/bin/python
 from Game import Game
+from Config import Config
+from BatchGame import BatchGame
+from MCTS import MCTS
+from Evaluator import makeEvaluator
+import numpy as np
 from tqdm import tqdm
 from multiprocessing import Pool
 
+arenaPlayers = None  # (player1, player2) of an arena worker process, set by initArenaWorker
+
+
+def loadMCTSPlayers(config: Config, folder, filenames):
+    """
+    Returns one player per checkpoint in filenames, each choosing the move
+    with the most MCTS visits for the network loaded from folder/filename.
+    The backend of each network is chosen by its file, see makeEvaluator.
+    """
+    game = Game()
+    players = []
+    for filename in filenames:
+        nnet = makeEvaluator(game, filename, config)
+        nnet.load_checkpoint(folder=folder, filename=filename, suppress=True)
+        mcts = MCTS(game, nnet, config)
+        players.append(lambda x, mcts=mcts: np.argmax(mcts.getActionProb(x, temp=0)))
+    return players
+
+
+def initArenaWorker(makePlayers, args):
+    """Pool initializer building the players of the worker once."""
+    global arenaPlayers
+    np.random.seed()  # forked workers would otherwise share the random state
+    arenaPlayers = makePlayers(*args)
+
+
+def playArenaGame(swapped):
+    """
+    Plays one game between the players of the worker, with player2 starting
+    if swapped. Returns the result as in Arena.playGame, for the player that
+    started.
+    """
+    player1, player2 = arenaPlayers
+    if swapped:
+        player1, player2 = player2, player1
+    return Arena(player1, player2, Game()).playGame()
+
 class Arena():
     """
     An Arena class where any 2 agents can be pit against each other.
@@ -94,4 +136,130 @@ class Arena():
             else:
                 draws += 1
 
-        return oneWon, twoWon, draws
\ No newline at end of file
+        return oneWon, twoWon, draws
+
+    def playGamesAsync(self, num, processes, makePlayers, args, disable_progress=False):
+        """
+        Plays num games like playGames, spread over a pool of processes.
+        Every worker calls makePlayers(*args) once to build its own copies of
+        player1 and player2 (see loadMCTSPlayers), since the player functions
+        of this arena can not be sent to other processes.
+        Returns:
+            oneWon: games won by player1
+            twoWon: games won by player2
+            draws:  games won by nobody
+        """
+        num = int(num / 2)
+        oneWon = 0
+        twoWon = 0
+        draws = 0
+
+        swaps = [False] * num + [True] * num
+        with Pool(processes, initializer=initArenaWorker, initargs=(makePlayers, args)) as pool:
+            results = pool.imap(playArenaGame, swaps)
+            for swapped, gameResult in tqdm(zip(swaps, results), total=len(swaps),
+                                            desc="Arena.playGamesAsync", disable=disable_progress):
+                if swapped:
+                    gameResult = -gameResult
+                if gameResult == 1:
+                    oneWon += 1
+                elif gameResult == -1:
+                    twoWon += 1
+                else:
+                    draws += 1
+
+        return oneWon, twoWon, draws
+
+
+class BatchArena():
+    """
+    Pits two networks against each other by playing all games at once in
+    lockstep. At every ply, the MCTS leaves of all running games are
+    evaluated with one batched prediction per network.
+    """
+
+    def __init__(self, nnet1, nnet2, game: Game, config: Config):
+        """
+        Input:
+            nnet 1,2: the networks of player 1,2, with a predictBatch method
+            game: Game object
+            config: the MCTS settings of both players
+        """
+        self.nnets = [nnet1, nnet2]
+        self.game = game
+        self.config = config
+
+    def playGames(self, num, disable_progress=False):
+        """
+        Plays num games in which player1 starts num/2 games and player2 starts
+        num/2 games. Each game gets its own MCTS per player, and the players
+        choose the move with the most visits as in Coach's arena.
+        Returns:
+            oneWon: games won by player1
+            twoWon: games won by player2
+            draws:  games won by nobody
+        """
+        num = int(num / 2)
+        starters = np.array([0] * num + [1] * num)  # index of the player that moves first
+        games = BatchGame(len(starters))
+        trees = [[MCTS(self.game, nnet, self.config) for nnet in self.nnets]
+                 for _ in starters]
+
+        with tqdm(desc="BatchArena.playGames", disable=disable_progress) as pbar:
+            live = np.nonzero(games.getWinStates() == 0)[0]
+            while len(live) > 0:
+                # the MCTS and root of the player to move in every live game
+                actions = np.full(len(starters), -1)
+                searches = []
+                for i in live:
+                    player = starters[i] if games.players[i] == 1 else 1 - starters[i]
+                    mcts = trees[i][player]
+                    board = self.game.getCanonicalForm(games.getBoard(i), games.players[i])
+                    entry = None if self.config.openingBookPriors else mcts.lookupBook(board)
+                    if entry is not None:
+                        mcts.bookHits += 1
+                        actions[i] = np.argmax(mcts.getBookProbs(entry[0], temp=0))
+                    else:
+                        searches.append((i, player, mcts) + mcts.startSearch(board))
+                if searches:
+                    self.search(searches)
+
+                for i, player, mcts, board, mirrored in searches:
+                    actions[i] = np.argmax(mcts.getProbs(board, mirrored, temp=0))
+                games.step(actions)
+                live = np.nonzero(games.getWinStates() == 0)[0]
+                pbar.update()
+
+        winners = games.getWinValues()
+        oneWon = int(np.sum((winners == 1) & (starters == 0)) + np.sum((winners == -1) & (starters == 1)))
+        twoWon = int(np.sum((winners == 1) & (starters == 1)) + np.sum((winners == -1) & (starters == 0)))
+        return oneWon, twoWon, len(starters) - oneWon - twoWon
+
+    def search(self, searches):
+        """
+        Runs numMCTSSims simulations from the root of every search, in rounds
+        of up to config.mctsBatchSize leaves per game. The leaves of all games
+        are evaluated with one predictBatch call per network each round.
+        """
+        sims = [0] * len(searches)
+        while min(sims) < self.config.numMCTSSims:
+            pending = [[], []]  # (mcts, leaves) per network
+            for j, (i, player, mcts, board, mirrored) in enumerate(searches):
+                if sims[j] < self.config.numMCTSSims:
+                    leaves, done = mcts.selectLeaves(board, min(
+                        self.config.mctsBatchSize, self.config.numMCTSSims - sims[j]))
+                    sims[j] += done
+                    if leaves:
+                        pending[player].append((mcts, leaves))
+
+            for nnet, player_pending in zip(self.nnets, pending):
+                if not player_pending:
+                    continue
+                boards = [board for mcts, leaves in player_pending
+                          for board in mcts.getLeafBoards(leaves)]
+                pis, vs = nnet.predictBatch(boards)
+                start = 0
+                for mcts, leaves in player_pending:
+                    end = start + len(leaves)
+                    mcts.expandLeaves(leaves, pis[start:end], vs[start:end])
+                    start = end
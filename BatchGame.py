@@ -0,0 +1,119 @@
+#!/usr/bin/python
+from Board import Board
+import numpy as np
+
+
+class BatchGame():
+    """
+    Represents num games of Connect 4 played in lockstep.
+    Every game is stored as two uint64 bitboards with the same layout as
+    Board, so that moves, valid moves and wins are computed for all games at
+    once with numpy.
+    Player1 is represented by 1, player2 is represented by -1.
+    """
+
+    def __init__(self, num) -> None:
+        base_board = Board()
+        self.num = num
+        self.height = base_board.height
+        self.width = base_board.width
+        self.win_length = base_board.win_length
+        assert (self.height + 1) * self.width <= 64, "Board does not fit in a uint64"
+
+        # bit of every cell, row 0 is the top of the board as in Board.state
+        rows = np.arange(self.height - 1, -1, -1, dtype=np.uint64)[:, np.newaxis]
+        cols = np.arange(self.width, dtype=np.uint64)[np.newaxis, :]
+        self.cell_bits = cols * np.uint64(self.height + 1) + rows
+
+        self.player1_masks = np.zeros(num, dtype=np.uint64)
+        self.player2_masks = np.zeros(num, dtype=np.uint64)
+        self.column_heights = np.zeros((num, self.width), dtype=np.int64)
+        self.players = np.ones(num, dtype=np.int64)  # player to move in each game
+
+    def step(self, actions):
+        """
+        Plays actions[i] for the player to move in game i, for every i with
+        actions[i] >= 0. Games with a negative action are left unchanged.
+        Raises a ValueError if a column is full.
+        """
+        actions = np.asarray(actions)
+        games = np.nonzero(actions >= 0)[0]
+        cols = actions[games]
+        rows = self.column_heights[games, cols]
+        if np.any(rows >= self.height):
+            raise ValueError("Column is full.")
+
+        bits = np.left_shift(np.uint64(1),
+                             (cols * (self.height + 1) + rows).astype(np.uint64))
+        player1 = self.players[games] == 1
+        self.player1_masks[games[player1]] |= bits[player1]
+        self.player2_masks[games[~player1]] |= bits[~player1]
+        self.column_heights[games, cols] += 1
+        self.players[games] *= -1
+
+    def getValidMoves(self):
+        """Returns a (num, width) boolean array of the valid moves of every game."""
+        return self.column_heights < self.height
+
+    def getWinValues(self):
+        """
+        Returns an array with 1 where player1 won, -1 where player2 won,
+        0 where the game is tied, and -100 where the game is not terminal.
+        """
+        values = np.full(self.num, -100, dtype=np.int64)
+        values[self.column_heights.sum(axis=1) >= self.height * self.width] = 0
+        values[self.__is_win_mask(self.player2_masks)] = -1
+        values[self.__is_win_mask(self.player1_masks)] = 1
+        return values
+
+    def getWinStates(self):
+        """
+        Returns, for the player to move in every game, 1 if the player won,
+        -1 if lost, 1e-4 if tied, and 0 if the game is not finished, as in
+        Game.getWinState.
+        """
+        values = self.getWinValues()
+        states = (values * self.players).astype(float)
+        states[values == 0] = 1e-4
+        states[values == -100] = 0
+        return states
+
+    def getStates(self):
+        """Returns a (num, height, width) float array with the state of every game."""
+        player1 = (self.player1_masks[:, np.newaxis, np.newaxis] >> self.cell_bits) & np.uint64(1)
+        player2 = (self.player2_masks[:, np.newaxis, np.newaxis] >> self.cell_bits) & np.uint64(1)
+        return player1.astype(float) - player2.astype(float)
+
+    def getCanonicalForms(self):
+        """
+        Returns the states of all games from the point of view of the player
+        to move, as in Game.getCanonicalForm.
+        """
+        return self.getStates() * self.players[:, np.newaxis, np.newaxis]
+
+    def getBoard(self, i) -> Board:
+        """Returns game i as a Board."""
+        board = Board()
+        board.player1_mask = int(self.player1_masks[i])
+        board.player2_mask = int(self.player2_masks[i])
+        board.column_heights = self.column_heights[i].tolist()
+        board.move_count = sum(board.column_heights)
+        return board
+
+    def __is_win_mask(self, masks):
+        """
+        Parameters
+        ----------
+        masks : np.ndarray
+            uint64 bitboards of one player's pieces
+        Returns a boolean array, True where the bitboard contains win_length
+        pieces in a row vertically, horizontally or diagonally.
+        """
+        wins = np.zeros(len(masks), dtype=bool)
+        # vertical, horizontal, and the two diagonals
+        for shift in (1, self.height + 1, self.height, self.height + 2):
+            lines = masks.copy()
+            for i in range(1, self.win_length):
+                lines &= masks >> np.uint64(i * shift)
+            wins |= lines != 0
+        return wins
@@ -1,8 +1,32 @@
 #!/usr/bin/python
+from functools import lru_cache
 import numpy as np
 
 
+@lru_cache(maxsize=None)
+def stateBitIndices(height, width) -> np.ndarray:
+    """
+    Returns the height x width array of the bitboard bit of every cell, with
+    row 0 at the top as in Board.state.
+    """
+    rows = np.arange(height - 1, -1, -1)[:, np.newaxis]
+    cols = np.arange(width)[np.newaxis, :]
+    indices = (cols * (height + 1) + rows).astype(np.uint64)
+    indices.flags.writeable = False
+    return indices
+
+
 class Board():
+    """
+    Connect 4 board stored as two bitboards, one per player, plus the height
+    of every column.
+
+    Each column uses height + 1 bits (the extra bit is an always empty sentinel
+    row so that shifts never carry a line from one column into the next).
+    Bit col * (height + 1) + row is set if the cell at row (counted from the
+    bottom) of column col is taken.
+    """
+
     def __init__(self, state=None) -> None:
         self.height = 6
         self.width = 7
@@ -10,89 +34,186 @@ class Board():
         self.empty_token = 0
         self.player1 = 1
         self.player2 = -1
-        self.state = np.copy(state)
-        if state is None:
-            self.state = np.zeros((self.height, self.width)).astype(float)
+        self.player1_mask = 0
+        self.player2_mask = 0
+        self.column_heights = [0] * self.width
+        self.move_count = 0
+        self.last_move = None  # column of the last move, None if unknown
+        if state is not None:
+            self.__load_state(np.asarray(state))
+
+    @property
+    def state(self) -> np.ndarray:
+        """
+        Returns a new height x width float array of the board with player1 as 1,
+        player2 as -1 and empty cells as 0. Row 0 is the top of the board.
+        Modifying the returned array does not modify the board.
+        """
+        masks = np.array([self.player1_mask, self.player2_mask], dtype=np.uint64)
+        bits = (masks[:, np.newaxis, np.newaxis] >> stateBitIndices(self.height, self.width)) & np.uint64(1)
+        # player1 is 1 and player2 is -1
+        return np.subtract(bits[0], bits[1], dtype=np.float64)
+
+    def copy(self, swap_players=False) -> "Board":
+        """
+        Returns a copy of the board. If swap_players is True, the pieces of
+        player1 and player2 are exchanged in the copy.
+        """
+        board = Board()
+        board.height = self.height
+        board.width = self.width
+        board.player1_mask = self.player1_mask
+        board.player2_mask = self.player2_mask
+        if swap_players:
+            board.player1_mask, board.player2_mask = board.player2_mask, board.player1_mask
+        board.column_heights = list(self.column_heights)
+        board.move_count = self.move_count
+        board.last_move = self.last_move
+        return board
 
     def move(self, player: int, action: int):
-        try:
-            col = self.state.transpose().tolist()[action]
-            empty_row = self.height - 1 - col[::-1].index(self.empty_token)
-            self.state[empty_row, action] = player
-        except ValueError:
+        if action < 0:
+            action += self.width
+        row = self.column_heights[action]
+        if row >= self.height:
             raise ValueError("Column is full.")
+        bit = 1 << self.__bit_index(row, action)
+        if player > 0:
+            self.player1_mask |= bit
+        else:
+            self.player2_mask |= bit
+        self.column_heights[action] = row + 1
+        self.move_count += 1
+        self.last_move = action
+
+    def getKey(self) -> int:
+        """
+        Returns an integer that identifies the position. Positions reached
+        through legal moves never share a key, boards with floating pieces
+        (only possible when built from a state array) can.
+        """
+        # per column, the occupied bits are 2**h - 1, and adding the player1
+        # bits gives a unique value below 2**(h + 1) that does not carry
+        # into the next column
+        return self.player1_mask + (self.player1_mask | self.player2_mask)
+
+    def getMirrorKey(self) -> int:
+        """Returns the key of the board flipped left to right."""
+        # keys do not carry between columns, so they mirror like bitboards
+        return self.__mirror_mask(self.getKey())
+
+    def mirror(self) -> "Board":
+        """Returns a copy of the board flipped left to right."""
+        board = self.copy()
+        board.player1_mask = self.__mirror_mask(self.player1_mask)
+        board.player2_mask = self.__mirror_mask(self.player2_mask)
+        board.column_heights = self.column_heights[::-1]
+        if self.last_move is not None:
+            board.last_move = self.width - 1 - self.last_move
+        return board
 
     def getValidMoves(self):
-        return self.state[0] == 0
+        return np.array([h < self.height for h in self.column_heights])
 
     def fullBoard(self):
-        return np.all(self.state[0] != 0)
+        return self.move_count >= self.height * self.width
 
     def getWinValue(self):
         """
         Returns 1 if player1 wins, -1 if player2 wins,
         0 if tied, and -100 if game is not terminal.
-        """
-        arr_list = self.state.transpose().tolist()
-        arr_list.extend(self.state.tolist())
-
-        diagonal_indices = range(-2, 4)
-        for idx in diagonal_indices:
-            main_diag = np.diagonal(self.state, offset=idx)
-            anti_diag = np.diagonal(np.fliplr(self.state), offset=idx)
-            arr_list.append(main_diag.tolist())
-            arr_list.append(anti_diag.tolist())
 
-        p1_win = self.__is_win_state_in_list(arr_list, self.player1)
-        p2_win = self.__is_win_state_in_list(arr_list, self.player2)
-
-        if p1_win:
+        If the last move is known, only the lines through the last piece are
+        checked, which assumes the game was not already won before that move.
+        This holds for every board reached by moving from a non-terminal board.
+        """
+        if self.last_move is not None:
+            return self.__get_last_move_win_value()
+        if self.__is_win_mask(self.player1_mask):
             return self.player1
-        elif p2_win:
+        elif self.__is_win_mask(self.player2_mask):
             return self.player2
         elif self.fullBoard():
             return 0
         else:
             return -100
 
-    def __is_win_state_in_list(self, arr_list, token) -> bool:
+    def __get_last_move_win_value(self):
+        """
+        Same as getWinValue, but only checks the four lines through the piece
+        placed by the last move.
+        """
+        bit = 1 << self.__bit_index(
+            self.column_heights[self.last_move] - 1, self.last_move)
+        if self.player1_mask & bit:
+            mask, player = self.player1_mask, self.player1
+        else:
+            mask, player = self.player2_mask, self.player2
+
+        # vertical, horizontal, and the two diagonals
+        for shift in (1, self.height + 1, self.height, self.height + 2):
+            length = 1
+            neighbour = bit << shift
+            while mask & neighbour:
+                length += 1
+                neighbour <<= shift
+            neighbour = bit >> shift
+            while mask & neighbour:
+                length += 1
+                neighbour >>= shift
+            if length >= self.win_length:
+                return player
+
+        return 0 if self.fullBoard() else -100
+
+    def __is_win_mask(self, mask) -> bool:
         """
         Parameters
         ----------
-        arr_list : list
-            list of arrays
-        token
-            value to find its longest sequence in each array
-        If there is a sequence of length >= 4 of value token in one of the arrays in
-        list, then returns True. Else False.
+        mask : int
+            bitboard of one player's pieces
+        Returns True if mask contains win_length pieces in a row vertically,
+        horizontally or diagonally.
         """
-        for arr in arr_list:
-            arr = np.array(arr)
-            if (arr == token).sum() < self.win_length:
-                continue
-            else:
-                if self.__find_longest_seq(arr, token) >= self.win_length:
-                    return True
+        # vertical, horizontal, and the two diagonals
+        for shift in (1, self.height + 1, self.height, self.height + 2):
+            line = mask
+            for i in range(1, self.win_length):
+                line &= mask >> (i * shift)
+            if line:
+                return True
         return False
 
-    def __find_longest_seq(self, arr, val) -> int:
+    def __mirror_mask(self, mask) -> int:
+        """Returns mask with the bits of column col moved to column width - 1 - col."""
+        column_bits = self.height + 1
+        column_mask = (1 << column_bits) - 1
+        mirrored = 0
+        for col in range(self.width):
+            mirrored |= ((mask >> (col * column_bits)) & column_mask) << \
+                ((self.width - 1 - col) * column_bits)
+        return mirrored
+
+    def __bit_index(self, row, col) -> int:
+        """Returns the bit of the cell at row (counted from the bottom) and col."""
+        return col * (self.height + 1) + row
+
+    def __load_state(self, state):
         """
-        Parameters
-        ----------
-        arr : np.ndarray
-            array containing val and other values
-        val
-            value in array to find the longest unbroken sequence of
-        Returns length of longest sequence of val in arr.
-        Inspired by https://stackoverflow.com/a/38161867
+        Sets the bitboards from a height x width array of player tokens.
+        Row 0 of the array is the top of the board.
         """
-        idx_pairs = np.where(np.diff(np.hstack(([False], arr == val, [False]))))[
-            0].reshape(-1, 2)
-        seq_lengths = np.diff(idx_pairs, axis=1)
-        if len(seq_lengths) > 0:
-            return max(np.diff(idx_pairs, axis=1))
-        else:
-            return 0
+        self.height, self.width = state.shape
+        occupied = state != self.empty_token
+        self.move_count = int(occupied.sum())
+        self.column_heights = np.where(
+            occupied.any(axis=0), self.height - occupied.argmax(axis=0), 0).tolist()
+        for r, c in zip(*np.nonzero(occupied)):
+            bit = 1 << self.__bit_index(self.height - 1 - int(r), int(c))
+            if state[r, c] == self.player1:
+                self.player1_mask |= bit
+            elif state[r, c] == self.player2:
+                self.player2_mask |= bit
 
     def __str__(self):
         return str(self.state)
@@ -1,63 +1,19 @@
 #!/usr/bin/python
 from Game import Game
-from NeuralNet import NeuralNet
 from Config import Config
 from MCTS import MCTS
-from Arena import Arena
+from Arena import Arena, BatchArena, loadMCTSPlayers
+from SelfPlayWorkers import SelfPlayWorkers
+from ReplayBuffer import ReplayBuffer
+from BatchGame import BatchGame
+from Metrics import timer, writeJsonLine, writePrometheus
 import numpy as np
-from collections import deque
+from collections import Counter
 from tqdm import tqdm
-from random import shuffle
 import os
+import re
 import sys
-from pickle import Pickler, Unpickler
-from multiprocessing import Pool
-
-
-def executeEpisodeProcess():
-    """
-    This function executes one episode of self-play, starting with player 1.
-    As the game is played, each turn is added as a training example to
-    trainExamples. The game is played till the game ends. After the game
-    ends, the outcome of the game is used to assign values to each example
-    in trainExamples.
-    It uses a temp=1 if episodeStep < tempThreshold, and thereafter
-    uses temp=0.
-    Returns:
-        trainExamples: a list of examples of the form (canonicalBoard, currPlayer, pi,v)
-                        pi is the MCTS informed policy vector, v is +1 if
-                        the player eventually won the game, else -1.
-    """
-    trainExamples = []
-    game = Game()
-    config = Config()
-    board = game.getInitBoard()
-    curPlayer = 1
-    episodeStep = 0
-
-    nnet = NeuralNet(game)
-    nnet.load_checkpoint(folder=config.checkpoint,
-                         filename='temp.pth.tar', suppress=True)
-    mcts = MCTS(game, nnet, config)
-
-    while True:
-        episodeStep += 1
-        canonicalBoard = game.getCanonicalForm(board, curPlayer)
-        temp = int(episodeStep < config.tempThreshold)
-
-        pi = mcts.getActionProb(canonicalBoard, temp=temp)
-        sym = game.getSymmetries(canonicalBoard, pi)
-        for b, p in sym:
-            trainExamples.append([b, curPlayer, p, None])
-
-        action = np.random.choice(len(pi), p=pi)
-        board, curPlayer = game.getNextState(
-            board, curPlayer, action)
-
-        r = game.getWinState(board, curPlayer)
-
-        if r != 0:
-            return [(x[0], x[2], r * ((-1) ** (x[1] != curPlayer))) for x in trainExamples]
+from pickle import Unpickler
 
 
 class Coach():
@@ -67,15 +23,21 @@ class Coach():
     Modified from https://github.com/suragnair/alpha-zero-general
     """
 
-    def __init__(self, game: Game, nnet: NeuralNet, config: Config):
+    def __init__(self, game: Game, nnet, config: Config):
         self.game = game
         self.nnet = nnet
-        self.pnet = self.nnet.__class__(self.game)  # the competitor network
+        self.pnet = self.nnet.__class__(self.game, self.nnet.config)  # the competitor network
         self.config = config
         self.mcts = MCTS(self.game, self.nnet, self.config)
-        # history of examples from args.numItersForTrainExamplesHistory latest iterations
-        self.trainExamplesHistory = []
+        # examples from config.numItersForTrainExamplesHistory latest iterations
+        self.replayBuffer = ReplayBuffer(os.path.join(
+            self.config.checkpoint, 'replay'), self.config.numItersForTrainExamplesHistory)
         self.skipFirstSelfPlay = False  # can be overriden in loadTrainExamples()
+        self.generation = 0  # increased every time a new model is accepted
+        self.selfPlayWorkers = None  # started by the first multiprocessing self-play
+        self.selfPlayInfo = Counter()  # stats of the last self-play, see generateTrainingData
+        self.iterationStats = []  # phase times and counts of every iteration, see learn
+        self.metricTotals = Counter()  # iterationStats summed over the iterations
 
     def executeEpisode(self):
         """
@@ -87,7 +49,7 @@ class Coach():
         It uses a temp=1 if episodeStep < tempThreshold, and thereafter
         uses temp=0.
         Returns:
-            trainExamples: a list of examples of the form (canonicalBoard, currPlayer, pi,v)
+            trainExamples: the examples (canonicalBoard, pi, v) packed by game.getExamples
                            pi is the MCTS informed policy vector, v is +1 if
                            the player eventually won the game, else -1.
         """
@@ -102,9 +64,8 @@ class Coach():
             temp = int(episodeStep < self.config.tempThreshold)
 
             pi = self.mcts.getActionProb(canonicalBoard, temp=temp)
-            sym = self.game.getSymmetries(canonicalBoard, pi)
-            for b, p in sym:
-                trainExamples.append([b, self.curPlayer, p, None])
+            # the mirror image is added while training, see Game.getExampleSymmetries
+            trainExamples.append([canonicalBoard.state, self.curPlayer, pi, None])
 
             action = np.random.choice(len(pi), p=pi)
             board, self.curPlayer = self.game.getNextState(
@@ -113,7 +74,8 @@ class Coach():
             r = self.game.getWinState(board, self.curPlayer)
 
             if r != 0:
-                return [(x[0], x[2], r * ((-1) ** (x[1] != self.curPlayer))) for x in trainExamples]
+                return self.game.getExamples(
+                    [(x[0], x[2], r * ((-1) ** (x[1] != self.curPlayer))) for x in trainExamples])
 
     def learn(self):
         """
@@ -122,6 +84,9 @@ class Coach():
         examples in trainExamples (which has a maximum length of maxlenofQueue).
         It then pits the new neural network against the old one and accepts it
         only if it wins >= updateThreshold fraction of games.
+        The seconds spent in self-play, training, checkpoint and replay buffer
+        I/O and the arena, and the counters of self-play, are saved for every
+        iteration, see saveIterationStats.
         """
         startingIndex = 1
         if self.config.iterationNum is not None:
@@ -130,139 +95,253 @@ class Coach():
         for i in range(startingIndex, self.config.numIters + 1):
             # bookkeeping
             print(f'Starting Iter #{i} ...')
+            stats = {'iteration': i, 'games': 0, 'examples': 0, 'evaluations': 0}
             # examples of the iteration
             if not self.skipFirstSelfPlay or i > startingIndex:
-                if self.config.multiprocessing:
-                    iterationTrainExamples, pool = self.generateTrainingDataAsync()
-                    pool.close()
-                    pool.join()
-                else:
-                    iterationTrainExamples = self.generateTrainingData()
-
-                # save the iteration examples to the history
-                self.trainExamplesHistory.append(iterationTrainExamples)
-
-            if len(self.trainExamplesHistory) > self.config.numItersForTrainExamplesHistory:
-                print(
-                    f"Removing the oldest entry in trainExamples. len(trainExamplesHistory) = {len(self.trainExamplesHistory)}")
-                self.trainExamplesHistory.pop(0)
-            # backup history to a file
-            # NB! the examples were collected using the model from the previous iteration, so (i-1)
-            self.saveTrainExamples(i - 1)
-
-            # shuffle examples before training
-            trainExamples = []
-            for e in self.trainExamplesHistory:
-                trainExamples.extend(e)
-            shuffle(trainExamples)
+                with timer(stats, 'selfPlayTime'):
+                    if self.config.multiprocessing:
+                        iterationTrainExamples = self.generateTrainingDataAsync()
+                    else:
+                        iterationTrainExamples = self.generateTrainingData()
+                stats.update(self.selfPlayInfo)
+                stats['games'] = self.config.numEps
+                stats['examples'] = len(iterationTrainExamples)
+                stats['evaluations'] = self.selfPlayInfo['cacheMisses']
+                stats['meanBatchSize'] = stats['evaluations'] / max(self.selfPlayInfo['networkCalls'], 1)
+
+                # save the iteration examples to the replay buffer, which retires the oldest
+                # NB! the examples were collected using the model from the previous iteration, so (i-1)
+                with timer(stats, 'checkpointTime'):
+                    self.saveTrainExamples(i - 1, iterationTrainExamples)
 
             # training new network, keeping a copy of the old one
-            self.nnet.save_checkpoint(
-                folder=self.config.checkpoint, filename='temp.pth.tar')
-            self.pnet.load_checkpoint(
-                folder=self.config.checkpoint, filename='temp.pth.tar')
+            with timer(stats, 'checkpointTime'):
+                self.nnet.save_checkpoint(
+                    folder=self.config.checkpoint, filename='temp.pth.tar')
+                self.pnet.load_checkpoint(
+                    folder=self.config.checkpoint, filename='temp.pth.tar')
             pmcts = MCTS(self.game, self.pnet, self.config)
 
-            self.nnet.train(trainExamples)
+            with timer(stats, 'trainTime'):
+                self.nnet.train(self.replayBuffer)
             nmcts = MCTS(self.game, self.nnet, self.config)
 
             print('PITTING AGAINST PREVIOUS VERSION')
             arena = Arena(lambda x: np.argmax(pmcts.getActionProb(x, temp=0)),
                           lambda x: np.argmax(nmcts.getActionProb(x, temp=0)), self.game)
-            # more multiprocessing, not efficient in beginning but for most of it yes because
-            # neural network takes longer and longer to fit.
-            pwins, nwins, draws = arena.playGames(self.config.arenaCompare)
+            # includes saving the networks for the arena workers
+            with timer(stats, 'arenaTime'):
+                if self.config.arenaLockstep:
+                    # all games in one process, leaves batched across games
+                    pwins, nwins, draws = BatchArena(
+                        self.pnet, self.nnet, self.game, self.config).playGames(self.config.arenaCompare)
+                elif self.config.multiprocessing:
+                    # every worker loads both networks once and plays its share of the games
+                    if self.config.numpyInference:
+                        self.pnet.export_checkpoint(
+                            folder=self.config.checkpoint, filename='temp.npz')
+                        self.nnet.export_checkpoint(
+                            folder=self.config.checkpoint, filename='new.npz')
+                        filenames = ['temp.npz', 'new.npz']
+                    else:
+                        self.nnet.save_checkpoint(
+                            folder=self.config.checkpoint, filename='new.pth.tar')
+                        filenames = ['temp.pth.tar', 'new.pth.tar']
+                    pwins, nwins, draws = arena.playGamesAsync(
+                        self.config.arenaCompare, self.config.processes, loadMCTSPlayers,
+                        (self.config, self.config.checkpoint, filenames))
+                else:
+                    pwins, nwins, draws = arena.playGames(self.config.arenaCompare)
 
             print('NEW/PREV WINS : %d / %d ; DRAWS : %d' %
                   (nwins, pwins, draws))
-            if pwins + nwins == 0 or float(nwins) / (pwins + nwins) < self.config.updateThreshold:
-                print('REJECTING NEW MODEL')
-                self.nnet.load_checkpoint(
-                    folder=self.config.checkpoint, filename='temp.pth.tar')
-            else:
-                print('ACCEPTING NEW MODEL')
-                self.nnet.save_checkpoint(
-                    folder=self.config.checkpoint, filename=self.getCheckpointFile(i))
-                self.nnet.save_checkpoint(
-                    folder=self.config.checkpoint, filename='best.pth.tar')
+            stats['accepted'] = not (pwins + nwins == 0 or
+                                     float(nwins) / (pwins + nwins) < self.config.updateThreshold)
+            with timer(stats, 'checkpointTime'):
+                if not stats['accepted']:
+                    print('REJECTING NEW MODEL')
+                    self.nnet.load_checkpoint(
+                        folder=self.config.checkpoint, filename='temp.pth.tar')
+                else:
+                    print('ACCEPTING NEW MODEL')
+                    self.generation += 1
+                    self.nnet.save_checkpoint(
+                        folder=self.config.checkpoint, filename=self.getCheckpointFile(i))
+                    self.nnet.save_checkpoint(
+                        folder=self.config.checkpoint, filename='best.pth.tar')
+            self.saveIterationStats(stats)
+
+        if self.selfPlayWorkers is not None:
+            self.selfPlayWorkers.stop()
+            self.selfPlayWorkers = None
+
+    def saveIterationStats(self, stats):
+        """
+        Appends the timers and counters of an iteration to iterationStats and
+        prints its phase times. They are also appended to config.metricsFile
+        as a line of JSON, and written with their totals over the iterations
+        to config.prometheusFile, for a local Prometheus scraper.
+        """
+        self.iterationStats.append(stats)
+        self.metricTotals.update({key: value for key, value in stats.items()
+                                  if key not in ('iteration', 'accepted', 'meanBatchSize')})
+        print(f'Iteration time: {stats.get("selfPlayTime", 0.):.1f}s self play, '
+              f'{stats["trainTime"]:.1f}s training, {stats["checkpointTime"]:.1f}s checkpoints, '
+              f'{stats["arenaTime"]:.1f}s arena')
+
+        if not os.path.exists(self.config.checkpoint):
+            os.makedirs(self.config.checkpoint)
+        if self.config.metricsFile is not None:
+            writeJsonLine(os.path.join(self.config.checkpoint, self.config.metricsFile), stats)
+        if self.config.prometheusFile is not None:
+            writePrometheus(os.path.join(self.config.checkpoint, self.config.prometheusFile),
+                            stats, self.metricTotals)
 
     def generateTrainingData(self):
-        iterationTrainExamples = deque(
-            [], maxlen=self.config.maxlenOfQueue)
+        episodeTrainExamples = []
 
+        info = Counter()
+        self.nnet.resetCacheStats()
         for _ in tqdm(range(self.config.numEps), desc="Self Play"):
             # reset search tree
             self.mcts = MCTS(self.game, self.nnet, self.config)
-            iterationTrainExamples += self.executeEpisode()
+            episodeTrainExamples.append(self.executeEpisode())
+            info.update(self.mcts.getBookStats())
+            info.update(self.mcts.getSearchStats())
+        info.update(self.nnet.getCacheStats())
+        info.update(self.nnet.getInferenceStats())
 
-        return iterationTrainExamples
+        self.printCacheStats(info)
+        self.printBookStats(info)
+        self.selfPlayInfo = info
+        return self.joinExamples(episodeTrainExamples)
 
     def generateTrainingDataAsync(self):
-        """Generates training data through multiprocessing.
-        Returns object that stores examples (only access after pool is joined and closed) and multiprocessing pool."""
-        iterationTrainExamples = deque(
-            [], maxlen=self.config.maxlenOfQueue)
-
-        print("Starting multiprocessing.")
-        pbar = tqdm(total=self.config.numEps,
-                    desc="Self Play", position=0, leave=True)
-
-        def update(result):
-            nonlocal iterationTrainExamples
-            iterationTrainExamples += result
-            pbar.update()
-
-        pool = Pool(self.config.processes)
-        for _ in range(self.config.numEps):
-            pool.apply_async(executeEpisodeProcess, callback=update)
+        """Generates training data with the long lived self-play workers,
+        publishing the current model to them first if it changed.
+        Returns examples of the iteration."""
+        episodeTrainExamples = []
+
+        info = Counter()
+        if self.selfPlayWorkers is None:
+            print("Starting multiprocessing.")
+            self.selfPlayWorkers = SelfPlayWorkers(self.config)
+        if self.selfPlayWorkers.generation != self.generation:
+            calibrationStates = self.getCalibrationStates() if self.config.quantizedInference else None
+            info['setupTime'] += self.selfPlayWorkers.publish(
+                self.nnet, self.generation, calibrationStates)
+
+        for examples, episodeInfo in tqdm(self.selfPlayWorkers.playEpisodes(self.config.numEps),
+                                          total=self.config.numEps, desc="Self Play"):
+            episodeTrainExamples.append(examples)
+            info.update(episodeInfo)
+        if self.selfPlayWorkers.inferenceServer is not None:
+            # the workers' clients do not see the batches of the server
+            info.update(self.selfPlayWorkers.inferenceServer.getStats())
+        iterationTrainExamples = self.joinExamples(episodeTrainExamples)
+
+        print(f'Self play: {self.config.numEps} episodes, {len(iterationTrainExamples)} examples, '
+              f'{info["setupTime"]:.1f}s model setup')
+        self.printCacheStats(info)
+        self.printBookStats(info)
+        self.selfPlayInfo = info
+        return iterationTrainExamples
 
-        return iterationTrainExamples, pool
+    def getCalibrationStates(self):
+        """
+        Returns config.quantizationSamples canonical states to calibrate the
+        quantized network on, drawn from the replay buffer, or from random games
+        while it is empty.
+        """
+        if len(self.replayBuffer) > 0:
+            return self.replayBuffer.getSample(self.config.quantizationSamples)['board']
+        games = BatchGame(self.config.quantizationSamples)
+        moves = np.random.randint(games.height * games.width, size=games.num)
+        for ply in range(moves.max()):
+            playing = (ply < moves) & (games.getWinStates() == 0)
+            games.step([np.random.choice(np.nonzero(valid)[0]) if p else -1
+                        for valid, p in zip(games.getValidMoves(), playing)])
+        return games.getCanonicalForms()
+
+    def joinExamples(self, episodeTrainExamples):
+        """Concatenates the examples of the episodes, keeping the latest config.maxlenOfQueue."""
+        examples = np.concatenate(
+            [self.game.getExamples([])] + episodeTrainExamples)
+        return examples[-self.config.maxlenOfQueue:]
+
+    def printBookStats(self, info):
+        """
+        Prints the share of self-play moves taken from the opening book, and
+        the search time it saved per episode, estimated from the mean search
+        time of the other moves.
+        """
+        moves = info['bookHits'] + info['searches']
+        if info['bookHits'] > 0:
+            saved = info['bookHits'] * info['searchTime'] / max(info['searches'], 1)
+            print(f'Opening book: {info["bookHits"]}/{moves} moves ({info["bookHits"] / moves:.1%}), '
+                  f'{saved / self.config.numEps:.2f}s search saved per episode')
+
+    def printCacheStats(self, info):
+        """Prints the evaluation cache stats summed in info, if the cache is enabled."""
+        lookups = info['cacheHits'] + info['cacheMisses']
+        if self.config.evalCacheSize > 0 and lookups > 0:
+            print(f'Evaluation cache: {info["cacheHits"]}/{lookups} hits '
+                  f'({info["cacheHits"] / lookups:.1%}), {info["cacheSavedTime"]:.1f}s inference saved')
 
     def getCheckpointFile(self, iteration):
         return 'checkpoint_' + str(iteration) + '.pth.tar'
 
-    def saveTrainExamples(self, iteration):
-        folder = self.config.checkpoint
-        if not os.path.exists(folder):
-            os.makedirs(folder)
-        filename = os.path.join(
-            folder, self.getCheckpointFile(iteration) + ".examples")
-        with open(filename, "wb+") as f:
-            Pickler(f).dump(self.trainExamplesHistory)
-        f.closed
+    def getCheckpointIteration(self, filename):
+        """Returns the iteration of a getCheckpointFile filename, or None."""
+        match = re.fullmatch(r'checkpoint_(\d+)\.pth\.tar', filename)
+        return int(match.group(1)) if match else None
+
+    def saveTrainExamples(self, iteration, examples):
+        self.replayBuffer.add(iteration, examples)
 
     def loadTrainExamples(self):
-        modelFile = os.path.join(
-            self.config.load_folder_file[0], self.config.load_folder_file[1])
-        examplesFile = modelFile + ".examples"
-        if not os.path.isfile(examplesFile):
-            print(f'File "{examplesFile}" with trainExamples not found!')
+        self.openExamples(*self.config.load_folder_file)
+        if self.replayBuffer.shards:
+            # examples based on the model were already collected (loaded)
+            self.skipFirstSelfPlay = True
+        else:
+            print(f'trainExamples of "{self.config.load_folder_file[1]}" not found!')
             r = input("Try with self.load_folder_file_examples? [y|n]")
             if r != "y":
                 sys.exit()
             self.loadPreviousExamples()
-        else:
-            print("File with trainExamples found. Loading it...")
-            with open(examplesFile, "rb") as f:
-                self.trainExamplesHistory = Unpickler(f).load()
-            print('Loading done!')
-
-            # examples based on the model were already collected (loaded)
-            self.skipFirstSelfPlay = True
 
     def loadPreviousExamples(self):
-        examplesFile = os.path.join(
-            self.config.load_folder_file_examples[0],
-            self.config.load_folder_file_examples[1]) + ".examples"
-        if not os.path.isfile(examplesFile):
-            print(f'File "{examplesFile}" with trainExamples not found!')
+        self.openExamples(*self.config.load_folder_file_examples)
+        if not self.replayBuffer.shards:
+            print(f'trainExamples of "{self.config.load_folder_file_examples[1]}" not found!')
             r = input("Continue? [y|n]")
             if r != "y":
                 sys.exit()
-        else:
-            print("File with trainExamples for previous model found. Loading it...")
-            with open(examplesFile, "rb") as f:
-                self.trainExamplesHistory = Unpickler(f).load()
-            print('Loading done!')
+        # do not skip first play since only old data and not from latest model
 
-            # do not skip first play since only old data and not from latest model
+    def openExamples(self, folder, filename):
+        """
+        Opens the replay buffer in folder up to the shard of the model filename,
+        or leaves it empty if that shard does not exist. A pickled history from
+        before the replay buffer is converted to shards first. New shards are
+        added to the same folder.
+        """
+        self.replayBuffer = ReplayBuffer(os.path.join(
+            folder, 'replay'), self.config.numItersForTrainExamplesHistory)
+        iteration = self.getCheckpointIteration(filename)
+        if iteration is None:
+            return
+        examplesFile = os.path.join(folder, filename + ".examples")
+        if not self.replayBuffer.hasShard(iteration) and os.path.isfile(examplesFile):
+            print("Converting pickled trainExamples to the replay buffer...")
+            with open(examplesFile, "rb") as f:
+                history = Unpickler(f).load()
+            for j, examples in enumerate(history):
+                # every move was stored with its mirror image after it, which is now
+                # added while training
+                self.replayBuffer.add(iteration - len(history) + 1 + j,
+                                      self.game.getExamples(list(examples)[::2]))
+        if self.replayBuffer.hasShard(iteration):
+            self.replayBuffer.open(iteration)
+            print(f'Loaded {len(self.replayBuffer)} trainExamples')
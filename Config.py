@@ -4,6 +4,15 @@ class Config():
     def __init__(self) -> None:
         self.numMCTSSims = 25
         self.cpuct = 2.5 # 1
+        self.mctsBatchSize = 1 # leaves evaluated per network call, 1 searches sequentially
+        self.virtualLoss = 1 # losses added to a path while its leaf waits for evaluation
+        self.mctsMaxNodes = 200000 # nodes kept per MCTS, must be above numMCTSSims, None for no limit
+        self.mirrorSymmetry = False # MCTS and evaluation cache store each mirror image pair once
+        self.evalCacheSize = 0 # positions kept by the NeuralNet evaluation cache, 0 disables it
+        self.checkKeyCollisions = False # debug: verify MCTS position keys are unique
+        self.openingBook = None # path of an opening book built by OpeningBook.py, None disables it
+        self.openingBookDepth = 4 # plies the opening book is consulted for
+        self.openingBookPriors = False # search book positions with the book policy as priors instead of playing the book
 
         self.numEps = 100
         self.numIters = 40
@@ -15,11 +24,16 @@ class Config():
         self.dropout = 0.3
         self.epochs = 10
         self.batch_size = 64
+        self.trainChunkSize = 4096 # examples read from the replay buffer at a time while training
+        self.shuffleBufferSize = 50000 # examples shuffled together while training
         self.cuda = False
         self.tempThreshold = 15
         self.checkpoint = './temp/'
+        self.metricsFile = 'metrics.jsonl' # timers and counters of every iteration appended as JSON lines in config.checkpoint, None disables them
+        self.prometheusFile = 'metrics.prom' # the same metrics in Prometheus text format in config.checkpoint, replaced every iteration, None disables it
 
         self.arenaCompare = 40
+        self.arenaLockstep = False # play all arena games in lockstep with batched network calls
         self.updateThreshold = 0.6
         self.load_folder_file = ('./temp', 'checkpoint_32.pth.tar')
         self.load_folder_file_examples = ('./temp', 'checkpoint_31.pth.tar')
@@ -29,4 +43,10 @@ class Config():
 
         self.multiprocessing = True
         self.processes = 3
+        self.inferenceServer = False # self-play workers share one network process
+        self.inferenceBatchSize = 64 # max states per network call of the inference server
+        self.inferenceMaxWait = 0.005 # max seconds the inference server waits to fill a batch
+        self.numpyInference = False # workers run an exported NumPy copy of the network instead of TensorFlow
+        self.quantizedInference = False # self-play workers run an int8 TFLite copy of the network, training stays float
+        self.quantizationSamples = 1000 # replay buffer positions used to calibrate the int8 network
 
@@ -0,0 +1,164 @@
+#!/usr/bin/python
+import time
+from collections import OrderedDict
+from Config import Config
+from Game import Game
+import numpy as np
+from Board import Board
+
+# upper bounds in seconds of the network latency histogram buckets, the last bucket has none
+LATENCY_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.5, 1.)
+
+
+def makeEvaluator(game: Game, filename, config: Config = None):
+    """
+    Returns an evaluator that can load the checkpoint filename, importing only
+    the backend it needs: NumpyNet for .npz exports, QuantizedNet for .tflite
+    models, and the TensorFlow NeuralNet otherwise. It is built with the
+    evaluation cache of config, and NeuralNet with its network size.
+    """
+    if filename.endswith('.npz'):
+        from NumpyNet import NumpyNet
+        return NumpyNet(game, config)
+    if filename.endswith('.tflite'):
+        from QuantizedNet import QuantizedNet
+        return QuantizedNet(game, config)
+    from NeuralNet import NeuralNet
+    return NeuralNet(game, config)
+
+
+class Evaluator():
+    """
+    Base class of the networks that evaluate boards for MCTS. It implements
+    predict and predictBatch, with the evaluation cache, on top of the
+    predictStates method of its subclasses. It does not import TensorFlow, so
+    that the engine modules using it do not either.
+    """
+
+    def __init__(self, game: Game, config: Config):
+        self.board_x, self.board_y = game.getBoardSize()
+        self.action_size = game.getActionSize()
+        self.config = config
+        self.game = game
+
+        # stores (pi, v) of recently evaluated boards s, least recently used first
+        self.cache = OrderedDict() if config.evalCacheSize > 0 else None
+        self.resetCacheStats()
+
+    def predict(self, board: Board):
+        """
+        Input:
+            board: current board in its canonical form.
+        Returns:
+            pi: a policy vector for the current board- a numpy array of length
+                game.getActionSize
+            v: a float in [-1,1] that gives the value of the current board
+        """
+        pis, vs = self.predictBatch([board])
+        return pis[0], vs[0:1]
+
+    def predictBatch(self, boards):
+        """
+        Input:
+            boards: a list of boards in their canonical form.
+        Returns:
+            pis: a numpy array of policy vectors, one row per board
+            vs: a numpy array with the value of each board
+        If the evaluation cache is enabled (config.evalCacheSize), only the
+        boards missing from it are passed to the network. With
+        config.mirrorSymmetry, a board also hits the entry of its mirror image,
+        with the policy reversed.
+        """
+        if self.cache is None:
+            return self.__evaluate(np.asarray([board.state for board in boards]))
+
+        if self.config.mirrorSymmetry:
+            # both boards of a mirror pair share the entry of their symmetric form
+            forms = [self.game.getSymmetricForm(board) for board in boards]
+            keys = [self.game.getPositionKey(board) for board, _ in forms]
+            mirrored = [mirror for _, mirror in forms]
+        else:
+            keys = [self.game.getPositionKey(board) for board in boards]
+            mirrored = [False] * len(boards)
+        pis = np.empty((len(boards), self.action_size), dtype=np.float32)
+        vs = np.empty(len(boards), dtype=np.float32)
+        misses = []
+        for i, s in enumerate(keys):
+            if s in self.cache:
+                self.cache.move_to_end(s)
+                pi, vs[i] = self.cache[s]
+                pis[i] = pi[::-1] if mirrored[i] else pi
+            else:
+                misses.append(i)
+        self.cacheHits += len(boards) - len(misses)
+
+        if misses:
+            miss_pis, miss_vs = self.__evaluate(
+                np.asarray([boards[i].state for i in misses]))
+            pis[misses] = miss_pis
+            vs[misses] = miss_vs
+            for i in misses:
+                self.cache[keys[i]] = (pis[i][::-1] if mirrored[i] else pis[i], vs[i])
+            while len(self.cache) > self.config.evalCacheSize:
+                self.cache.popitem(last=False)
+        return pis, vs
+
+    def __evaluate(self, states):
+        """Runs the network on states and counts the boards and time it took."""
+        start = time.perf_counter()
+        pis, vs = self.predictStates(states)
+        seconds = time.perf_counter() - start
+        self.inferenceTime += seconds
+        self.cacheMisses += len(states)
+        self.networkCalls += 1
+        self.latencyCounts[np.searchsorted(LATENCY_BUCKETS, seconds)] += 1
+        return pis, vs
+
+    def clearCache(self):
+        """Empties the evaluation cache, needed whenever the weights change."""
+        if self.cache is not None:
+            self.cache.clear()
+
+    def resetCacheStats(self):
+        self.cacheHits = 0
+        self.cacheMisses = 0  # boards evaluated by the network
+        self.inferenceTime = 0.  # seconds spent evaluating them
+        self.networkCalls = 0  # predictStates calls evaluating them
+        self.latencyCounts = np.zeros(len(LATENCY_BUCKETS) + 1, dtype=np.int64)  # calls per LATENCY_BUCKETS bucket
+
+    def getCacheStats(self):
+        """
+        Returns the evaluation cache hits and misses since the last
+        resetCacheStats, and an estimate of the inference seconds the hits
+        saved.
+        """
+        timePerBoard = self.inferenceTime / self.cacheMisses if self.cacheMisses else 0.
+        return {
+            'cacheHits': self.cacheHits,
+            'cacheMisses': self.cacheMisses,
+            'cacheSavedTime': self.cacheHits * timePerBoard,
+        }
+
+    def getInferenceStats(self):
+        """
+        Returns the network calls since the last resetCacheStats, the seconds
+        they took, and the number of calls in each bucket of LATENCY_BUCKETS
+        as a numpy array. The boards they evaluated are the cacheMisses of
+        getCacheStats.
+        """
+        return {
+            'networkCalls': self.networkCalls,
+            'inferenceTime': self.inferenceTime,
+            'latencyCounts': self.latencyCounts.copy(),
+        }
+
+    def predictStates(self, states):
+        """
+        Input:
+            states: a numpy array of board states in their canonical form, of
+                    shape (batch, board_y, board_x).
+        Returns:
+            pis: a numpy array of policy vectors, one row per state
+            vs: a numpy array with the value of each state
+        """
+        raise NotImplementedError
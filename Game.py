@@ -20,7 +20,7 @@ class Game():
 
         Returns new board and next player.
         """
-        board = Board(board.state)
+        board = board.copy()
         board.move(player, action)
         return board, -player
 
@@ -45,11 +45,35 @@ class Game():
             raise ValueError(f"Unexpected win value {win_value}")
 
     def getCanonicalForm(self, board: Board, player: int) -> Board:
-        return Board(board.state * player)
+        return board.copy(swap_players=player == board.player2)
 
     def stringRepresentation(self, board: Board):
         return str(board)
 
+    def getPositionKey(self, board: Board) -> int:
+        """
+        Returns a compact hashable key for board, used to index the MCTS tables.
+        """
+        return board.getKey()
+
+    def getSymmetricForm(self, board: Board):
+        """
+        Returns the board or its mirror image, whichever has the smaller
+        position key, so that both boards of a mirror pair map to the same
+        board. Also returns whether the returned board is mirrored, in which
+        case its policy vectors have to be reversed to apply to board.
+        """
+        if board.getMirrorKey() < board.getKey():
+            return board.mirror(), True
+        return board, False
+
+    def getPieceMasks(self, board: Board):
+        """
+        Returns the bitboards (player1_mask, player2_mask) of board. A board
+        can only be reached from another board if it contains all its pieces.
+        """
+        return board.player1_mask, board.player2_mask
+
     def getActionSize(self) -> int:
         return Board().width
 
@@ -65,6 +89,36 @@ class Game():
         state = board.state
         return [(state, pi), (state[:, ::-1], pi[::-1])]
 
+    def getExampleDtype(self):
+        """Numpy dtype of one training example: int8 board, float16 pi, float32 v."""
+        board_x, board_y = self.getBoardSize()
+        return np.dtype([('board', np.int8, (board_y, board_x)),
+                         ('pi', np.float16, (self.getActionSize(),)),
+                         ('v', np.float32)])
+
+    def getExamples(self, examples):
+        """
+        Packs a list of examples of the form (board.state, pi, v) into a
+        structured array of getExampleDtype, which takes 60 bytes per example.
+        """
+        packed = np.zeros(len(examples), dtype=self.getExampleDtype())
+        if examples:
+            boards, pis, vs = list(zip(*examples))
+            packed['board'] = boards
+            packed['pi'] = pis
+            packed['v'] = vs
+        return packed
+
+    def getExampleSymmetries(self, examples):
+        """
+        Returns the examples of a getExamples array followed by their left/right
+        mirror images.
+        """
+        mirrored = examples.copy()
+        mirrored['board'] = examples['board'][:, :, ::-1]
+        mirrored['pi'] = examples['pi'][:, ::-1]
+        return np.concatenate([examples, mirrored])
+
     @staticmethod
     def display(board: Board):
         print(" -----------------------")
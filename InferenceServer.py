@@ -0,0 +1,174 @@
+#!/usr/bin/python
+from Game import Game
+from Config import Config
+from Board import Board
+from Evaluator import LATENCY_BUCKETS, makeEvaluator
+import numpy as np
+import queue
+import time
+from multiprocessing import Process, Queue
+
+
+RELOAD = -1  # client id of the requests asking the server to reload its weights
+STATS = -2  # client id of the requests asking the server for its stats
+
+
+def newStats():
+    """Returns zeroed server stats, named as in Evaluator.getCacheStats and getInferenceStats."""
+    return {
+        'cacheMisses': 0,
+        'networkCalls': 0,
+        'inferenceTime': 0.,
+        'latencyCounts': np.zeros(len(LATENCY_BUCKETS) + 1, dtype=np.int64),
+    }
+
+
+def serve(config: Config, requests: Queue, responses, reloaded: Queue):
+    """
+    Runs in the inference process. Loads the network from temp.pth.tar, then
+    answers requests until it receives None.
+    A request is a tuple (client_id, states). Requests are merged into one
+    batch until it holds config.inferenceBatchSize states or
+    config.inferenceMaxWait seconds have passed since the first request, or
+    every client has a request in the batch.
+    The result (pis, vs) for each request is put on responses[client_id].
+    The seconds spent building the network and loading its weights are put on
+    reloaded. A request (RELOAD, None) reloads temp.pth.tar, and the seconds
+    it took are put on reloaded as well. A request (STATS, None) puts the
+    boards, network calls and latencies since the last such request on
+    reloaded. A stop or control request that arrives while a batch is filling
+    is handled after that batch is answered.
+    """
+    start = time.perf_counter()
+    # only the server process imports TensorFlow
+    nnet = makeEvaluator(Game(), 'temp.pth.tar', config)
+    nnet.load_checkpoint(folder=config.checkpoint,
+                         filename='temp.pth.tar', suppress=True)
+    reloaded.put(time.perf_counter() - start)
+
+    stats = newStats()
+    held = []  # a stop or control request taken while a batch was filling
+    while True:
+        request = held.pop() if held else requests.get()
+        if request is None:
+            break
+        if request[0] == RELOAD:
+            start = time.perf_counter()
+            nnet.load_checkpoint(folder=config.checkpoint,
+                                 filename='temp.pth.tar', suppress=True)
+            reloaded.put(time.perf_counter() - start)
+            continue
+        if request[0] == STATS:
+            reloaded.put(stats)
+            stats = newStats()
+            continue
+        batch = [request]
+        size = len(request[1])
+        deadline = time.monotonic() + config.inferenceMaxWait
+        while size < config.inferenceBatchSize and len(batch) < len(responses):
+            try:
+                request = requests.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if request is None or request[0] < 0:
+                # handled once the batch is answered
+                held.append(request)
+                break
+            batch.append(request)
+            size += len(request[1])
+
+        states = np.concatenate([states for _, states in batch]).astype(np.float32)
+        start = time.perf_counter()
+        pis, vs = nnet.predictStates(states)
+        seconds = time.perf_counter() - start
+        stats['cacheMisses'] += len(states)
+        stats['networkCalls'] += 1
+        stats['inferenceTime'] += seconds
+        stats['latencyCounts'][np.searchsorted(LATENCY_BUCKETS, seconds)] += 1
+        start = 0
+        for client_id, client_states in batch:
+            end = start + len(client_states)
+            responses[client_id].put((pis[start:end], vs[start:end]))
+            start = end
+
+
+class InferenceClient():
+    """
+    Stands in for NeuralNet in self-play workers by sending boards to an
+    InferenceServer. Each client can have one request in flight.
+    """
+
+    def __init__(self, client_id, requests: Queue, responses):
+        self.client_id = client_id
+        self.requests = requests
+        self.response = responses[client_id]
+
+    def predict(self, board: Board):
+        """
+        Input:
+            board: current board in its canonical form.
+        Returns:
+            pi: a policy vector for the current board- a numpy array of length
+                game.getActionSize
+            v: a float in [-1,1] that gives the value of the current board
+        """
+        pis, vs = self.predictBatch([board])
+        return pis[0], vs[0]
+
+    def predictBatch(self, boards):
+        """
+        Input:
+            boards: a list of boards in their canonical form.
+        Returns:
+            pis: a numpy array of policy vectors, one row per board
+            vs: a numpy array with the value of each board
+        """
+        states = np.asarray([board.state for board in boards], dtype=np.int8)
+        self.requests.put((self.client_id, states))
+        return self.response.get()
+
+
+class InferenceServer():
+    """
+    One process that holds the network and evaluates the positions sent by
+    the InferenceClients of all self-play workers in shared batches.
+    """
+
+    def __init__(self, config: Config, num_clients):
+        self.requests = Queue()
+        self.responses = [Queue() for _ in range(num_clients)]
+        self.reloaded = Queue()
+        self.process = Process(target=serve, args=(
+            config, self.requests, self.responses, self.reloaded), daemon=True)
+
+    def start(self):
+        """
+        Starts the server and waits until its network is loaded.
+        Returns:
+            seconds: time the server spent building and loading the network
+        """
+        self.process.start()
+        return self.reloaded.get()
+
+    def reload(self):
+        """
+        Reloads the weights from temp.pth.tar. The requests sent before are
+        evaluated with the old weights.
+        Returns:
+            seconds: time the server spent loading the weights
+        """
+        self.requests.put((RELOAD, None))
+        return self.reloaded.get()
+
+    def getStats(self):
+        """
+        Returns the boards the server evaluated ('cacheMisses'), its network
+        calls, their seconds and latency histogram since the last call, as
+        Evaluator.getCacheStats and getInferenceStats name them.
+        """
+        self.requests.put((STATS, None))
+        return self.reloaded.get()
+
+    def stop(self):
+        self.requests.put(None)
+        self.process.join()
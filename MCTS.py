@@ -1,11 +1,14 @@
 #!/usr/bin/python
 import math
+import sys
+import time
 
 import numpy as np
 from Game import Game
 from Board import Board
 from Config import Config
-from NeuralNet import NeuralNet
+from Evaluator import Evaluator
+from OpeningBook import OpeningBook
 
 EPS = 1e-8
 
@@ -13,35 +16,164 @@ EPS = 1e-8
 class MCTS():
     """
     This class handles the MCTS tree. Taken from https://github.com/suragnair/alpha-zero-general
+
+    Every expanded board s gets a row in the node table. The row holds the
+    statistics of all actions of s in contiguous numpy arrays, so that the
+    child with the highest upper confidence bound is found with one argmax.
     """
 
-    def __init__(self, game: Game, nnet: NeuralNet, config: Config):
+    def __init__(self, game: Game, nnet: Evaluator, config: Config):
+        if config.mctsMaxNodes is not None and config.mctsMaxNodes <= config.numMCTSSims:
+            # a search adds up to numMCTSSims nodes, which can not be evicted while it runs
+            raise ValueError(f"mctsMaxNodes ({config.mctsMaxNodes}) must be above "
+                             f"numMCTSSims ({config.numMCTSSims})")
         self.game = game
         self.nnet = nnet
         self.config = config
-        self.Qsa = {}  # stores Q values for s,a (as defined in the paper)
-        self.Nsa = {}  # stores #times edge s,a was visited
-        self.Ns = {}  # stores #times board s was visited
-        self.Ps = {}  # stores initial policy (returned by neural net)
+        self.action_size = game.getActionSize()
+
+        self.nodes = {}  # stores the node table row of each expanded board s
+        capacity = 256
+        self.Qsa = np.zeros((capacity, self.action_size))  # stores Q values for s,a (as defined in the paper)
+        self.Nsa = np.zeros((capacity, self.action_size), dtype=np.int64)  # stores #times edge s,a was visited
+        self.Ns = np.zeros(capacity, dtype=np.int64)  # stores #times board s was visited
+        self.Ps = np.zeros((capacity, self.action_size))  # stores initial policy (returned by neural net)
+        self.Vs = np.zeros((capacity, self.action_size), dtype=bool)  # stores game.getValidMoves for board s
+        self.VLsa = np.zeros((capacity, self.action_size), dtype=np.int64)  # stores virtual losses of pending edges s,a
+        self.Ms = np.zeros((capacity, 2), dtype=np.uint64)  # stores game.getPieceMasks for board s
+        self.Ks = np.zeros(capacity, dtype=object)  # stores the key s of each row
+        self.rows = 0  # number of rows of the node table in use or freed
+        self.free = []  # rows of removed nodes, reused before new rows
+
+        self.Es = {}  # stores game.getWinState for terminal boards s
 
-        self.Es = {}  # stores game.getGameEnded ended for board s
-        self.Vs = {}  # stores game.getValidMoves for board s
+        # debug only: stores game.stringRepresentation for every key s
+        self.keyBoards = {} if config.checkKeyCollisions else None
+
+        self.root = None  # key of the last board passed to getActionProb
+        self.evictions = 0  # nodes removed to stay within config.mctsMaxNodes
+        self.pruned = 0  # nodes removed because they could no longer be reached
+        self.peakNodes = 0
+        self.peakBytes = 0
+
+        self.book = OpeningBook(game, config.openingBook) if config.openingBook else None
+        self.bookHits = 0  # getActionProb calls answered by the opening book
+        self.searches = 0  # getActionProb calls that searched
+        self.searchTime = 0.  # seconds spent in those searches
+        self.simulations = 0  # MCTS iterations run by getActionProb
+        self.expansions = 0  # boards added to the node table
+        self.terminalHits = 0  # iterations that ended on a terminal board
 
     def getActionProb(self, canonicalBoard: Board, temp=1):
         """
         This function performs numMCTSSims simulations of MCTS starting from
-        canonicalBoard.
+        canonicalBoard. If config.mctsBatchSize is above 1, the simulations are
+        run in batches whose leaves are evaluated together (see searchBatch).
+
+        Before searching, nodes that can not be reached from a new
+        canonicalBoard are dropped, and if the table could outgrow
+        config.mctsMaxNodes, the least visited nodes are evicted.
+
+        If config.mirrorSymmetry is set, the search runs on the symmetric form
+        of every board (see Game.getSymmetricForm), so mirror images share
+        their nodes, and the probabilities are mirrored back for canonicalBoard.
+
+        If config.openingBook is set and canonicalBoard is in the book, the
+        book policy is returned without searching, unless
+        config.openingBookPriors is set.
 
         Returns:
             probs: a policy vector where the probability of the ith action is
                    proportional to Nsa[(s,a)]**(1./temp)
         """
-        for i in range(self.config.numMCTSSims):
-            self.search(canonicalBoard)
+        if not self.config.openingBookPriors:
+            entry = self.lookupBook(canonicalBoard)
+            if entry is not None:
+                self.bookHits += 1
+                return self.getBookProbs(entry[0], temp)
+
+        start = time.perf_counter()
+        canonicalBoard, mirrored = self.startSearch(canonicalBoard)
 
-        s = self.game.stringRepresentation(canonicalBoard)
-        counts = [self.Nsa[(s, a)] if (
-            s, a) in self.Nsa else 0 for a in range(self.game.getActionSize())]
+        if self.config.mctsBatchSize > 1:
+            sims = 0
+            while sims < self.config.numMCTSSims:
+                sims += self.searchBatch(canonicalBoard, min(
+                    self.config.mctsBatchSize, self.config.numMCTSSims - sims))
+        else:
+            for i in range(self.config.numMCTSSims):
+                self.search(canonicalBoard)
+            sims = self.config.numMCTSSims
+
+        probs = self.getProbs(canonicalBoard, mirrored, temp)
+        self.searches += 1
+        self.simulations += sims
+        self.searchTime += time.perf_counter() - start
+        return probs
+
+    def lookupBook(self, canonicalBoard: Board):
+        """
+        Returns the opening book (pi, v) of canonicalBoard, or None if there is
+        no book, the board is past config.openingBookDepth plies, or it is not
+        in the book.
+        """
+        if self.book is None or canonicalBoard.move_count >= self.config.openingBookDepth:
+            return None
+        return self.book.lookup(canonicalBoard)
+
+    @staticmethod
+    def getBookProbs(pi, temp=1):
+        """Returns the book policy pi raised to the power 1/temp, as getProbs does with visit counts."""
+        if temp == 0:
+            bestAs = np.array(np.argwhere(pi == np.max(pi))).flatten()
+            probs = [0] * len(pi)
+            probs[np.random.choice(bestAs)] = 1
+            return probs
+        pi = pi ** (1. / temp)
+        return (pi / pi.sum()).tolist()
+
+    def getRootValue(self, canonicalBoard: Board):
+        """
+        Returns the mean value of the actions searched from canonicalBoard
+        weighted by their visit counts, for the player to move.
+        """
+        canonicalBoard, _ = self.orient(canonicalBoard)
+        node = self.nodes[self.getKey(canonicalBoard)]
+        return float(np.dot(self.Nsa[node], self.Qsa[node]) / max(self.Nsa[node].sum(), 1))
+
+    def startSearch(self, canonicalBoard: Board):
+        """
+        Prepares the tables for a search from canonicalBoard: drops the nodes
+        that can not be reached from it if it is a new root, and evicts nodes
+        if the search could outgrow config.mctsMaxNodes.
+
+        Returns:
+            board: canonicalBoard passed through orient, to search from
+            mirrored: whether board is mirrored
+        """
+        canonicalBoard, mirrored = self.orient(canonicalBoard)
+        s = self.getKey(canonicalBoard)
+        if s != self.root:
+            self.root = s
+            self.prune(canonicalBoard)
+        if self.config.mctsMaxNodes is not None:
+            # leave room for the nodes added by this search
+            self.evict(self.config.mctsMaxNodes - self.config.numMCTSSims, s)
+        return canonicalBoard, mirrored
+
+    def getProbs(self, board: Board, mirrored, temp=1):
+        """
+        Returns the policy vector of the root board returned by startSearch,
+        where the probability of the ith action is proportional to
+        Nsa[(s,a)]**(1./temp), mirrored back if the board is mirrored.
+        """
+        s = self.getKey(board)
+        if s in self.nodes:
+            counts = self.Nsa[self.nodes[s]].tolist()
+        else:
+            counts = [0] * self.action_size
+        if mirrored:
+            counts = counts[::-1]
 
         if temp == 0:
             bestAs = np.array(np.argwhere(counts == np.max(counts))).flatten()
@@ -55,6 +187,30 @@ class MCTS():
         probs = [x / counts_sum for x in counts]
         return probs
 
+    def getKey(self, canonicalBoard: Board):
+        """
+        Returns the key of canonicalBoard in the MCTS tables. If
+        config.checkKeyCollisions is set, raises a ValueError when two
+        different boards get the same key.
+        """
+        s = self.game.getPositionKey(canonicalBoard)
+        if self.keyBoards is not None:
+            board_string = self.game.stringRepresentation(canonicalBoard)
+            if self.keyBoards.setdefault(s, board_string) != board_string:
+                raise ValueError(
+                    f"Key collision for {s}:\n{self.keyBoards[s]}\n{board_string}")
+        return s
+
+    def orient(self, canonicalBoard: Board):
+        """
+        Returns the board the tables store canonicalBoard as, and whether it is
+        mirrored: the symmetric form if config.mirrorSymmetry is set, else
+        canonicalBoard itself.
+        """
+        if self.config.mirrorSymmetry:
+            return self.game.getSymmetricForm(canonicalBoard)
+        return canonicalBoard, False
+
     def search(self, canonicalBoard: Board):
         """
         This function performs one iteration of MCTS. It is recursively called
@@ -75,67 +231,297 @@ class MCTS():
             v: the negative of the value of the current canonicalBoard
         """
 
-        s = self.game.stringRepresentation(canonicalBoard)
+        canonicalBoard, _ = self.orient(canonicalBoard)
+        s = self.getKey(canonicalBoard)
 
-        if s not in self.Es:
-            self.Es[s] = self.game.getWinState(canonicalBoard, 1)
-        if self.Es[s] != 0:
-            # terminal node
-            return -self.Es[s]
+        node = self.nodes.get(s)
+        if node is None:
+            if s in self.Es:
+                # terminal node
+                self.terminalHits += 1
+                return -self.Es[s]
+            end = self.game.getWinState(canonicalBoard, 1)
+            if end != 0:
+                # terminal node
+                self.terminalHits += 1
+                self.Es[s] = end
+                return -end
 
-        if s not in self.Ps:
             # leaf node
-            self.Ps[s], v = self.nnet.predict(canonicalBoard)
-            valids = self.game.getValidMoves(canonicalBoard)
-            self.Ps[s] = self.Ps[s] * valids  # masking invalid moves
-            sum_Ps_s = np.sum(self.Ps[s])
-            if sum_Ps_s > 0:
-                self.Ps[s] /= sum_Ps_s  # renormalize
-            else:
-                # if all valid moves were masked make all valid moves equally probable
-
-                # NB! All valid moves may be masked if either your NNet architecture is insufficient or you've get overfitting or something else.
-                # If you have got dozens or hundreds of these messages you should pay attention to your NNet and/or training process.
-                print("All valid moves were masked, doing a workaround.")
-                self.Ps[s] = self.Ps[s] + valids
-                self.Ps[s] /= np.sum(self.Ps[s])
-
-            self.Vs[s] = valids
-            self.Ns[s] = 0
-            return -v
-
-        valids = self.Vs[s]
-        cur_best = -float('inf')
-        best_act = -1
-
-        # pick the action with the highest upper confidence bound
-        for a in range(self.game.getActionSize()):
-            if valids[a]:
-                if (s, a) in self.Qsa:
-                    u = self.Qsa[(s, a)] + self.config.cpuct * self.Ps[s][a] * math.sqrt(self.Ns[s]) / (
-                        1 + self.Nsa[(s, a)])
-                else:
-                    u = self.config.cpuct * \
-                        self.Ps[s][a] * math.sqrt(self.Ns[s] + EPS)  # Q = 0 ?
-
-                if u > cur_best:
-                    cur_best = u
-                    best_act = a
-
-        a = best_act
+            pi, v = self.nnet.predict(canonicalBoard)
+            self.addNode(s, canonicalBoard, pi)
+            return -np.asarray(v).item()
+
+        a = self.selectAction(node)
         next_s, next_player = self.game.getNextState(canonicalBoard, 1, a)
         next_s = self.game.getCanonicalForm(next_s, next_player)
 
         v = self.search(next_s)
 
-        if (s, a) in self.Qsa:
-            self.Qsa[(s, a)] = (self.Nsa[(s, a)] *
-                                self.Qsa[(s, a)] + v) / (self.Nsa[(s, a)] + 1)
-            self.Nsa[(s, a)] += 1
+        self.update(node, a, v)
+        return -v
 
+    def searchBatch(self, canonicalBoard: Board, batch_size):
+        """
+        This function performs up to batch_size iterations of MCTS starting
+        from canonicalBoard (as returned by startSearch) and evaluates all of
+        their leaves with a single call to the neural network.
+
+        Returns:
+            sims: the number of iterations performed
+        """
+        leaves, sims = self.selectLeaves(canonicalBoard, batch_size)
+        if leaves:
+            pis, vs = self.nnet.predictBatch(self.getLeafBoards(leaves))
+            self.expandLeaves(leaves, pis, vs)
+        return sims
+
+    def selectLeaves(self, canonicalBoard: Board, batch_size):
+        """
+        Runs the selection of up to batch_size iterations of MCTS starting
+        from canonicalBoard (as returned by startSearch), without evaluating
+        the leaves they reach.
+
+        While a path waits for its leaf to be evaluated, virtual losses are
+        added to its edges so that the next paths of the batch spread over
+        other leaves. The batch ends early if a path reaches a leaf that is
+        already waiting. Terminal leaves are backed up right away.
+
+        Returns:
+            leaves: the board and path of each leaf s waiting for the network,
+                    to be passed to expandLeaves with their evaluations
+            sims: the number of iterations performed
+        """
+        leaves = {}
+        sims = 0
+        while sims < batch_size:
+            board = canonicalBoard
+            path = []
+            s = self.getKey(board)
+            node = self.nodes.get(s)
+            while node is not None:
+                a = self.selectAction(node)
+                self.VLsa[node, a] += self.config.virtualLoss
+                path.append((node, a))
+                next_s, next_player = self.game.getNextState(board, 1, a)
+                board, _ = self.orient(self.game.getCanonicalForm(next_s, next_player))
+                s = self.getKey(board)
+                node = self.nodes.get(s)
+
+            if s in leaves:
+                self.backup(path, None)
+                break
+            sims += 1
+
+            if s not in self.Es:
+                end = self.game.getWinState(board, 1)
+                if end == 0:
+                    leaves[s] = (board, path)
+                    continue
+                self.Es[s] = end
+            # terminal node
+            self.terminalHits += 1
+            self.backup(path, -self.Es[s])
+        return leaves, sims
+
+    @staticmethod
+    def getLeafBoards(leaves):
+        """Returns the boards of leaves from selectLeaves, in order."""
+        return [board for board, _ in leaves.values()]
+
+    def expandLeaves(self, leaves, pis, vs):
+        """
+        Expands the leaves from selectLeaves with the policies pis and values
+        vs of their boards, and backs the values up their paths.
+        """
+        for (s, (board, path)), pi, v in zip(leaves.items(), pis, vs):
+            self.addNode(s, board, pi)
+            self.backup(path, -float(v))
+
+    def selectAction(self, node):
+        """
+        Returns the valid action of node with the highest upper confidence
+        bound. Pending virtual losses count as visits that lost the game.
+        """
+        Qsa = self.Qsa[node]
+        Nsa = self.Nsa[node]
+        Ns = self.Ns[node]
+        VLsa = self.VLsa[node]
+        if VLsa.any():
+            Qsa = (Nsa * Qsa - VLsa) / np.maximum(Nsa + VLsa, 1)
+            Nsa = Nsa + VLsa
+            Ns = Ns + VLsa.sum()
+
+        cpuct_Ps = self.config.cpuct * self.Ps[node]
+        u = np.where(Nsa > 0,
+                     Qsa + cpuct_Ps * math.sqrt(Ns) / (1 + Nsa),
+                     cpuct_Ps * math.sqrt(Ns + EPS))  # Q = 0 ?
+        u[~self.Vs[node]] = -float('inf')
+        return int(np.argmax(u))
+
+    def update(self, node, a, v):
+        """Adds a visit with value v to edge a of node."""
+        n = self.Nsa[node, a]
+        self.Qsa[node, a] = (n * self.Qsa[node, a] + v) / (n + 1)
+        self.Nsa[node, a] += 1
+        self.Ns[node] += 1
+
+    def backup(self, path, v):
+        """
+        Removes the virtual losses from the (node, action) edges of path and,
+        unless v is None, propagates the leaf value v up the path.
+        """
+        for node, a in reversed(path):
+            self.VLsa[node, a] -= self.config.virtualLoss
+            if v is not None:
+                self.update(node, a, v)
+                v = -v
+
+    def addNode(self, s, canonicalBoard: Board, pi):
+        """
+        Expands board s: stores the initial policy pi masked by the valid moves
+        of canonicalBoard in a free row of the node table, growing the table
+        if it is full. With config.openingBookPriors, the book policy replaces
+        pi for boards in the opening book.
+
+        Returns:
+            node: the row of s in the node table
+        """
+        if self.config.openingBookPriors:
+            entry = self.lookupBook(canonicalBoard)
+            if entry is not None:
+                pi = entry[0]
+        if self.free:
+            node = self.free.pop()
+            self.Qsa[node] = 0
+            self.Nsa[node] = 0
+            self.Ns[node] = 0
         else:
-            self.Qsa[(s, a)] = v
-            self.Nsa[(s, a)] = 1
+            node = self.rows
+            self.rows += 1
+            if node == len(self.Ns):
+                self.Qsa = self.__grow(self.Qsa)
+                self.Nsa = self.__grow(self.Nsa)
+                self.Ns = self.__grow(self.Ns)
+                self.Ps = self.__grow(self.Ps)
+                self.Vs = self.__grow(self.Vs)
+                self.VLsa = self.__grow(self.VLsa)
+                self.Ms = self.__grow(self.Ms)
+                self.Ks = self.__grow(self.Ks)
+        self.nodes[s] = node
+        self.Ks[node] = s
+        self.expansions += 1
+        self.Ms[node] = self.game.getPieceMasks(canonicalBoard)
+        self.peakNodes = max(self.peakNodes, len(self.nodes))
 
-        self.Ns[s] += 1
-        return -v
+        valids = self.game.getValidMoves(canonicalBoard)
+        Ps = self.Ps[node]
+        Ps[:] = pi
+        Ps *= valids  # masking invalid moves
+        sum_Ps_s = np.sum(Ps)
+        if sum_Ps_s > 0:
+            Ps /= sum_Ps_s  # renormalize
+        else:
+            # if all valid moves were masked make all valid moves equally probable
+
+            # NB! All valid moves may be masked if either your NNet architecture is insufficient or you've get overfitting or something else.
+            # If you have got dozens or hundreds of these messages you should pay attention to your NNet and/or training process.
+            print("All valid moves were masked, doing a workaround.")
+            Ps += valids
+            Ps /= np.sum(Ps)
+
+        self.Vs[node] = valids
+        return node
+
+    def removeNode(self, s):
+        """Removes board s from the node table and frees its row."""
+        self.free.append(self.nodes.pop(s))
+        if self.keyBoards is not None:
+            self.keyBoards.pop(s, None)
+
+    def prune(self, canonicalBoard: Board):
+        """
+        Removes the nodes that can no longer be reached from canonicalBoard,
+        i.e. the boards that do not contain all of its pieces, and forgets
+        the terminal boards.
+        """
+        self.Es.clear()
+        if not self.nodes:
+            return
+        keys = list(self.nodes)
+        Ms = self.Ms[list(self.nodes.values())]
+        roots = [canonicalBoard]
+        if self.config.mirrorSymmetry:
+            # nodes may store the mirror image of a board reached from canonicalBoard
+            roots.append(canonicalBoard.mirror())
+        reachable = np.zeros(len(keys), dtype=bool)
+        for root in roots:
+            mask1, mask2 = (np.uint64(m) for m in self.game.getPieceMasks(root))
+            # the pieces of root swap sides in boards an odd number of moves away
+            reachable |= (((Ms[:, 0] & mask1) == mask1) & ((Ms[:, 1] & mask2) == mask2)) | \
+                         (((Ms[:, 1] & mask1) == mask1) & ((Ms[:, 0] & mask2) == mask2))
+        unreachable = np.nonzero(~reachable)[0]
+        for i in unreachable:
+            self.removeNode(keys[i])
+        self.pruned += len(unreachable)
+
+    def evict(self, max_nodes, root):
+        """
+        Removes the least visited nodes other than root until at most
+        max_nodes nodes are left.
+        """
+        self.peakBytes = max(self.peakBytes, self.getMemoryBytes())
+        excess = len(self.nodes) - max(max_nodes, 1)
+        if excess <= 0:
+            return
+        keys = [s for s in self.nodes if s != root]
+        Ns = self.Ns[[self.nodes[s] for s in keys]]
+        excess = min(excess, len(keys))
+        for i in np.argpartition(Ns, excess - 1)[:excess]:
+            self.removeNode(keys[i])
+        self.evictions += excess
+
+    def getMemoryBytes(self):
+        """Returns an estimate of the bytes used by the MCTS tables."""
+        tables = [self.Qsa, self.Nsa, self.Ns, self.Ps, self.Vs, self.VLsa, self.Ms, self.Ks]
+        return sum(table.nbytes for table in tables) + sys.getsizeof(self.nodes) + \
+            sys.getsizeof(self.Es) + sys.getsizeof(self.free)
+
+    def getStats(self):
+        """Returns the counters of the node table."""
+        self.peakBytes = max(self.peakBytes, self.getMemoryBytes())
+        return {
+            'nodes': len(self.nodes),
+            'peakNodes': self.peakNodes,
+            'evictions': self.evictions,
+            'pruned': self.pruned,
+            'bytes': self.getMemoryBytes(),
+            'peakBytes': self.peakBytes,
+        }
+
+    def getBookStats(self):
+        """
+        Returns the moves answered by the opening book, the moves searched and
+        the seconds spent searching.
+        """
+        return {
+            'bookHits': self.bookHits,
+            'searches': self.searches,
+            'searchTime': self.searchTime,
+        }
+
+    def getSearchStats(self):
+        """
+        Returns the MCTS iterations run by getActionProb, the boards expanded
+        and the iterations that ended on a terminal board.
+        """
+        return {
+            'simulations': self.simulations,
+            'expansions': self.expansions,
+            'terminalHits': self.terminalHits,
+        }
+
+    @staticmethod
+    def __grow(table):
+        """Returns table with twice as many rows, the new rows set to 0."""
+        return np.concatenate([table, np.zeros_like(table)])
@@ -0,0 +1,85 @@
+#!/usr/bin/python
+import json
+import os
+import time
+from contextlib import contextmanager
+from Evaluator import LATENCY_BUCKETS
+import numpy as np
+
+# stats key, Prometheus name and help of the gauges of the last iteration
+GAUGES = [
+    ('iteration', 'c4_iteration', 'Last finished training iteration.'),
+    ('meanBatchSize', 'c4_nn_mean_batch_size', 'Mean boards per network call in the last self-play.'),
+    ('accepted', 'c4_model_accepted', '1 if the arena accepted the model of the last iteration.'),
+]
+# stats key and label of the phase timers, exported per iteration and in total
+PHASES = [
+    ('selfPlayTime', 'self_play'),
+    ('trainTime', 'train'),
+    ('checkpointTime', 'checkpoint'),
+    ('arenaTime', 'arena'),
+]
+# stats key, Prometheus name and help of the counters, summed over all iterations
+COUNTERS = [
+    ('games', 'c4_selfplay_games_total', 'Self-play games played.'),
+    ('examples', 'c4_selfplay_examples_total', 'Training examples produced by self-play.'),
+    ('simulations', 'c4_mcts_simulations_total', 'MCTS iterations run in self-play.'),
+    ('expansions', 'c4_mcts_expanded_nodes_total', 'Boards added to the MCTS node tables in self-play.'),
+    ('terminalHits', 'c4_mcts_terminal_hits_total', 'MCTS iterations that ended on a terminal board.'),
+    ('cacheHits', 'c4_nn_cache_hits_total', 'Boards answered by the evaluation cache.'),
+    ('cacheMisses', 'c4_nn_evaluated_boards_total', 'Boards evaluated by the network in self-play.'),
+    ('networkCalls', 'c4_nn_calls_total', 'Network calls in self-play.'),
+]
+
+
+@contextmanager
+def timer(stats, key):
+    """Adds the seconds spent in the with block to stats[key]."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats[key] = stats.get(key, 0.) + time.perf_counter() - start
+
+
+def writeJsonLine(filepath, stats):
+    """Appends stats to filepath as one line of JSON, numpy values as numbers and lists."""
+    with open(filepath, 'a') as f:
+        f.write(json.dumps(stats, default=lambda value: np.asarray(value).tolist()) + '\n')
+
+
+def writePrometheus(filepath, stats, totals):
+    """
+    Writes the gauges and phase times of the iteration stats, and the
+    counters and network latency histogram of totals, the stats summed over
+    all iterations, to filepath in the Prometheus text format. The file is
+    replaced at once, so a scraper never reads it half written.
+    """
+    lines = []
+
+    def add(name, kind, help_text, samples):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        lines.extend(f'{name}{labels} {float(value)!r}' for labels, value in samples)
+
+    for key, name, help_text in GAUGES:
+        if key in stats:
+            add(name, 'gauge', help_text, [('', stats[key])])
+    add('c4_iteration_phase_seconds', 'gauge', 'Seconds of each phase of the last iteration.',
+        [(f'{{phase="{label}"}}', stats.get(key, 0.)) for key, label in PHASES])
+    add('c4_phase_seconds_total', 'counter', 'Seconds of each phase over all iterations.',
+        [(f'{{phase="{label}"}}', totals.get(key, 0.)) for key, label in PHASES])
+    for key, name, help_text in COUNTERS:
+        add(name, 'counter', help_text, [('', totals.get(key, 0))])
+
+    counts = totals.get('latencyCounts')
+    if counts is not None:
+        cumulative = np.cumsum(counts)
+        bounds = [f'{bound:g}' for bound in LATENCY_BUCKETS] + ['+Inf']
+        add('c4_nn_latency_seconds', 'histogram', 'Latency of the network calls in self-play.',
+            [(f'_bucket{{le="{bound}"}}', count) for bound, count in zip(bounds, cumulative)] +
+            [('_sum', totals.get('inferenceTime', 0.)), ('_count', cumulative[-1])])
+
+    with open(filepath + '.tmp', 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(filepath + '.tmp', filepath)
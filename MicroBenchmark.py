@@ -0,0 +1,254 @@
+#!/usr/bin/python
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from Game import Game
+from Board import Board
+from Config import Config
+from MCTS import MCTS
+import numpy as np
+
+"""
+use this script to measure the operations per second and memory of the hot
+paths of the engine, the search and the network, on fixed random positions
+and a tiny randomly initialized network, and to compare them with a saved
+baseline. It exits with status 1 if a benchmark got slower or used more
+memory than regression_threshold allows.
+"""
+
+seed = 0
+repeats = 5  # timings per benchmark, the fastest one counts
+min_time = 0.2  # seconds every timing runs for at least
+regression_threshold = 0.1  # relative slowdown or memory growth reported as a regression
+results_file = './temp/benchmark.json'
+baseline_file = './temp/benchmark_baseline.json'
+save_baseline = False  # save the results as the new baseline instead of comparing
+
+
+def tinyConfig():
+    """Returns a config with a network small enough to build and run in seconds."""
+    config = Config()
+    config.num_channels = 16
+    config.num_residual_layers = 1
+    config.numMCTSSims = 50
+    config.mctsBatchSize = 1
+    return config
+
+
+def tinyNet(game: Game, config: Config):
+    """Returns a NeuralNet of config with random weights, seeded with seed."""
+    import tensorflow as tf
+    from NeuralNet import NeuralNet
+    tf.random.set_seed(seed)
+    return NeuralNet(game, config)
+
+
+def randomGames(game: Game, num, rng):
+    """Returns the (board, player) positions of num random games, one list per game."""
+    games = []
+    for _ in range(num):
+        board, player = game.getInitBoard(), 1
+        positions = [(board, player)]
+        while game.getWinState(board, player) == 0:
+            action = rng.choice(np.nonzero(game.getValidMoves(board))[0])
+            board, player = game.getNextState(board, player, action)
+            positions.append((board, player))
+        games.append(positions)
+    return games
+
+
+def moveBench(game: Game, games):
+    """Replays the moves of games on new boards."""
+    moves = [[(player, board.last_move) for (_, player), (board, _) in zip(positions, positions[1:])]
+             for positions in games]
+
+    def run():
+        for game_moves in moves:
+            board = Board()
+            for player, action in game_moves:
+                board.move(player, action)
+    return run, sum(len(game_moves) for game_moves in moves)
+
+
+def winValueBench(game: Game, games):
+    boards = [board for positions in games for board, _ in positions]
+
+    def run():
+        for board in boards:
+            board.getWinValue()
+    return run, len(boards)
+
+
+def canonicalFormBench(game: Game, games):
+    positions = [position for positions in games for position in positions]
+
+    def run():
+        for board, player in positions:
+            game.getCanonicalForm(board, player)
+    return run, len(positions)
+
+
+def stringRepresentationBench(game: Game, games):
+    boards = [game.getCanonicalForm(board, player) for positions in games for board, player in positions]
+
+    def run():
+        for board in boards:
+            game.stringRepresentation(board)
+    return run, len(boards)
+
+
+def searchBench(game: Game, games):
+    """
+    Searches the first positions of games with a fresh MCTS each, so every run
+    builds the same trees. The network's evaluation cache is filled by the
+    warm up run, so the timing is that of the tree search.
+    """
+    config = tinyConfig()
+    config.evalCacheSize = 100000
+    nnet = tinyNet(game, config)
+    roots = [game.getCanonicalForm(board, player) for positions in games for board, player in positions[:4]
+             if game.getWinState(board, player) == 0]
+
+    def run():
+        mcts = MCTS(game, nnet, config)
+        for board in roots:
+            mcts.getActionProb(board, temp=1)
+    return run, len(roots) * config.numMCTSSims
+
+
+def predictBench(game: Game, games):
+    """Evaluates single boards with the evaluation cache disabled, as MCTS.search does."""
+    config = tinyConfig()
+    config.evalCacheSize = 0
+    nnet = tinyNet(game, config)
+    boards = [game.getCanonicalForm(board, player) for positions in games for board, player in positions]
+
+    def run():
+        for board in boards:
+            nnet.predict(board)
+    return run, len(boards)
+
+
+benchmarks = {
+    'Board.move': moveBench,
+    'Board.getWinValue': winValueBench,
+    'Game.getCanonicalForm': canonicalFormBench,
+    'Game.stringRepresentation': stringRepresentationBench,
+    'MCTS.search': searchBench,
+    'NeuralNet.predict': predictBench,
+}
+
+
+def measure(run, ops):
+    """
+    Returns the operations per second of the fastest of repeats timings of
+    run, which performs ops operations, and the memory of one more run
+    traced with tracemalloc: the most bytes it held at once and the blocks it
+    left allocated, both per operation.
+    """
+    run()  # warm up
+    best = float('inf')
+    for _ in range(repeats):
+        calls = 0
+        start = time.perf_counter()
+        while True:
+            run()
+            calls += 1
+            seconds = time.perf_counter() - start
+            if seconds >= min_time:
+                break
+        best = min(best, seconds / calls)
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    start_bytes, _ = tracemalloc.get_traced_memory()
+    run()
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, 'filename'))
+    return {
+        'ops': ops,
+        'opsPerSec': ops / best,
+        'peakBytesPerOp': (peak_bytes - start_bytes) / ops,
+        'retainedBlocksPerOp': blocks / ops,
+    }
+
+
+def runBenchmarks(game: Game, names=None):
+    """
+    Returns the results of the benchmarks in names, all of them if None.
+    Benchmarks that need TensorFlow are skipped if it is not installed.
+    """
+    results = {}
+    for name in names or benchmarks:
+        np.random.seed(seed)
+        rng = np.random.RandomState(seed)
+        games = randomGames(game, 20, rng)
+        try:
+            run, ops = benchmarks[name](game, games)
+        except ImportError as e:
+            print(f'{name:28s} skipped: {e}')
+            continue
+        results[name] = measure(run, ops)
+        print(f'{name:28s} {results[name]["opsPerSec"]:12.1f} ops/sec '
+              f'{results[name]["peakBytesPerOp"]:10.1f} peak bytes/op')
+    return results
+
+
+def compareResults(results, baseline, threshold):
+    """
+    Returns the regressions of results against baseline, as (name, metric,
+    baseline value, new value) tuples: the benchmarks whose ops/sec dropped,
+    or whose peak bytes per op grew, by more than threshold.
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        old = baseline[name]
+        if result['opsPerSec'] < old['opsPerSec'] * (1 - threshold):
+            regressions.append((name, 'opsPerSec', old['opsPerSec'], result['opsPerSec']))
+        # small allocations are noise, such as the ints of a dict resize
+        if result['peakBytesPerOp'] > max(old['peakBytesPerOp'] * (1 + threshold), old['peakBytesPerOp'] + 64):
+            regressions.append((name, 'peakBytesPerOp', old['peakBytesPerOp'], result['peakBytesPerOp']))
+    return regressions
+
+
+def saveResults(results, filepath):
+    folder = os.path.dirname(filepath)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+    report = {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'seed': seed,
+        'benchmarks': results,
+    }
+    with open(filepath, 'w') as f:
+        json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    g = Game()
+    results = runBenchmarks(g)
+    saveResults(results, baseline_file if save_baseline else results_file)
+    if save_baseline:
+        print(f'baseline saved to {baseline_file}')
+        sys.exit(0)
+    if not os.path.exists(baseline_file):
+        print(f'no baseline in {baseline_file}, save one with save_baseline = True')
+        sys.exit(0)
+
+    with open(baseline_file) as f:
+        baseline = json.load(f)['benchmarks']
+    regressions = compareResults(results, baseline, regression_threshold)
+    for name, metric, old, new in regressions:
+        print(f'regression in {name} {metric}: {old:.1f} -> {new:.1f} ({new / old - 1:+.1%})')
+    print(f'{len(regressions)} regressions against {baseline_file}')
+    sys.exit(1 if regressions else 0)
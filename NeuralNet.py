@@ -2,56 +2,82 @@
 import warnings
 warnings.filterwarnings("ignore")
 import os
+import tensorflow as tf
 from C4Model import C4Model
 from Config import Config
 from Game import Game
+from Evaluator import Evaluator
+from NumpyNet import exportModel
 import numpy as np
-from Board import Board
 
 
-class NeuralNet():
+class NeuralNet(Evaluator):
     """
     The neural network does not consider the current player, and instead only deals with
     the canonical form of the board. Modified from https://github.com/suragnair/alpha-zero-general
     """
 
-    def __init__(self, game: Game):
-        config = Config()
+    def __init__(self, game: Game, config: Config = None):
+        config = config or Config()
+        super().__init__(game, config)
         self.nnet = C4Model(game, config)
-        self.board_x, self.board_y = game.getBoardSize()
-        self.action_size = game.getActionSize()
-        self.config = config
 
-    def train(self, examples):
+        # traced once for float32 batches of any size, instead of dispatching
+        # the Keras model eagerly on every call
+        self.fastPredict = tf.function(
+            lambda states: self.nnet.model(states, training=False),
+            input_signature=[tf.TensorSpec(shape=(None, self.board_y, self.board_x), dtype=tf.float32)])
+
+    def train(self, replayBuffer):
         """
         This function trains the neural network with examples obtained from
         self-play.
         Input:
-            examples: a list of training examples, where each example is of form
-                      (board.state, pi, v). pi is the MCTS informed policy vector for
-                      the given board, and v is its value. The examples has
-                      board in its canonical form.
+            replayBuffer: a ReplayBuffer holding the training examples, packed by
+                          Game.getExamples, with fields board, pi and v. pi is the
+                          MCTS informed policy vector for the given board, and v is
+                          its value. The examples has board in its canonical form.
+        The examples are streamed from the replay buffer in chunks of
+        config.trainChunkSize, together with their mirror images, shuffled in a
+        buffer of config.shuffleBufferSize examples and batched while the
+        previous batch trains, so memory does not grow with the history.
         """
-        input_boards, target_pis, target_vs = list(zip(*examples))
-        input_boards = np.asarray(input_boards)
-        target_pis = np.asarray(target_pis)
-        target_vs = np.asarray(target_vs)
+        board_x, board_y = self.game.getBoardSize()
+        signature = (tf.TensorSpec(shape=(None, board_y, board_x), dtype=tf.float32),
+                     (tf.TensorSpec(shape=(None, self.action_size), dtype=tf.float32),
+                      tf.TensorSpec(shape=(None,), dtype=tf.float32)))
+        dataset = tf.data.Dataset.from_generator(
+            lambda: self.getTrainingChunks(replayBuffer), output_signature=signature)
+        dataset = dataset.unbatch() \
+            .shuffle(self.config.shuffleBufferSize) \
+            .batch(self.config.batch_size) \
+            .prefetch(tf.data.AUTOTUNE)
+
+        self.nnet.model.fit(dataset, epochs=self.config.epochs)
+        self.clearCache()
 
-        self.nnet.model.fit(x=input_boards, y=[target_pis, target_vs],
-                            batch_size=self.config.batch_size, epochs=self.config.epochs)
+    def getTrainingChunks(self, replayBuffer):
+        """
+        Yields (boards, (pis, vs)) network inputs and targets for every chunk
+        of the replay buffer and its mirror image, in a random order.
+        """
+        for examples in replayBuffer.getChunks(self.config.trainChunkSize):
+            # decoded to network input only here
+            examples = self.game.getExampleSymmetries(examples)
+            yield (examples['board'].astype(np.float32),
+                   (examples['pi'].astype(np.float32), examples['v']))
 
-    def predict(self, board: Board):
+    def predictStates(self, states):
         """
         Input:
-            board: current board in its canonical form.
+            states: a numpy array of board states in their canonical form, of
+                    shape (batch, board_y, board_x).
         Returns:
-            pi: a policy vector for the current board- a numpy array of length
-                game.getActionSize
-            v: a float in [-1,1] that gives the value of the current board
+            pis: a numpy array of policy vectors, one row per state
+            vs: a numpy array with the value of each state
         """
-        state = board.state[np.newaxis, :, :]
-        pi, v = self.nnet.model(state, training=False)
-        return pi[0], v[0]
+        pis, vs = self.fastPredict(np.asarray(states, dtype=np.float32))
+        return pis.numpy(), vs.numpy()[:, 0]
 
     def save_checkpoint(self, folder, filename):
         """
@@ -67,11 +93,37 @@ class NeuralNet():
             print("Checkpoint Directory exists! ")
         self.nnet.model.save_weights(filepath)
 
+    def export_checkpoint(self, folder, filename):
+        """
+        Saves the network in folder/filename in the format of NumpyNet
+        """
+        if not os.path.exists(folder):
+            os.mkdir(folder)
+        exportModel(self.nnet.model, os.path.join(folder, filename))
+
+    def export_quantized(self, folder, filename, states):
+        """
+        Saves an int8 quantized copy of the network as a TFLite model in
+        folder/filename, for QuantizedNet. The ranges of the activations are
+        calibrated on states, a numpy array of canonical board states.
+        Inputs and outputs stay float32.
+        """
+        if not os.path.exists(folder):
+            os.mkdir(folder)
+        states = np.asarray(states, dtype=np.float32)
+        converter = tf.lite.TFLiteConverter.from_keras_model(self.nnet.model)
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = lambda: ([states[i:i + 1]] for i in range(len(states)))
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        with open(os.path.join(folder, filename), 'wb') as f:
+            f.write(converter.convert())
+
     def load_checkpoint(self, folder, filename, suppress=False):
         """
         Loads parameters of the neural network from folder/filename
         """
         filepath = os.path.join(folder, filename)
         self.nnet.model.load_weights(filepath)
+        self.clearCache()
         if not suppress:
             print('Loading Weights...')
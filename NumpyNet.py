@@ -0,0 +1,192 @@
+#!/usr/bin/python
+import os
+import json
+from collections import Counter
+from numpy.lib.stride_tricks import sliding_window_view
+from Config import Config
+from Game import Game
+from Evaluator import Evaluator
+import numpy as np
+
+
+def exportModel(model, filepath):
+    """
+    Saves the Keras model of a C4Model as a NumPy weights file for NumpyNet.
+    The file holds the float32 weights and the list of operations of the
+    forward pass. Every BatchNormalization that directly follows a
+    convolution is folded into the convolution's kernel and bias, the others
+    become a per-channel scale and shift.
+    """
+    config = model.get_config()
+    inbound = {}
+    for layer in config['layers']:
+        node = layer['inbound_nodes'][0] if layer['inbound_nodes'] else []
+        if node and isinstance(node[0], str):
+            node = [node]  # the nodes of TF op layers are not nested
+        inbound[layer['name']] = [tensor[0] for tensor in node]
+    consumers = Counter(name for names in inbound.values() for name in names)
+
+    ops = []
+    kinds = {}  # op of every exported layer
+    renamed = {}  # name of the op that computes a folded layer
+    weights = {}
+    for layer in config['layers']:
+        name, kind, layer_config = layer['name'], layer['class_name'], layer['config']
+        inputs = [renamed.get(source, source) for source in inbound[name]]
+        params = [w.astype(np.float32) for w in model.get_layer(name).get_weights()]
+        op = {'name': name, 'inputs': inputs}
+
+        if kind == 'InputLayer':
+            input_name = name
+            continue
+        elif kind == 'Reshape':
+            op['op'] = 'reshape'
+            op['shape'] = list(layer_config['target_shape'])
+        elif kind == 'Conv2D':
+            assert tuple(layer_config['strides']) == (1, 1), "Only strides of 1 are supported"
+            assert tuple(layer_config['dilation_rate']) == (1, 1), "Only dilation of 1 is supported"
+            assert layer_config['activation'] == 'linear', "Only linear convolutions are supported"
+            op['op'] = 'conv'
+            op['padding'] = layer_config['padding']
+            weights[name + '/kernel'] = params[0]
+            weights[name + '/bias'] = params[1] if layer_config['use_bias'] \
+                else np.zeros(params[0].shape[-1], dtype=np.float32)
+        elif kind == 'BatchNormalization':
+            scale, shift = getBatchNormAffine(layer_config, params)
+            source = inputs[0]
+            if kinds.get(source) == 'conv' and consumers[inbound[name][0]] == 1:
+                # conv followed by batch norm is a conv with a scaled kernel
+                weights[source + '/kernel'] = weights[source + '/kernel'] * scale
+                weights[source + '/bias'] = weights[source + '/bias'] * scale + shift
+                renamed[name] = source
+                continue
+            op['op'] = 'affine'
+            weights[name + '/scale'] = scale
+            weights[name + '/shift'] = shift
+        elif kind == 'TFOpLambda' and 'relu' in layer_config['function']:
+            op['op'] = 'relu'
+        elif kind == 'Activation':
+            op['op'] = layer_config['activation']
+        elif kind == 'Add':
+            op['op'] = 'add'
+        elif kind == 'Flatten':
+            op['op'] = 'flatten'
+        elif kind == 'Dense':
+            op['op'] = 'dense'
+            op['activation'] = layer_config['activation']
+            weights[name + '/kernel'] = params[0]
+            weights[name + '/bias'] = params[1] if layer_config['use_bias'] \
+                else np.zeros(params[0].shape[-1], dtype=np.float32)
+        else:
+            raise ValueError(f"Cannot export layer {name} of type {kind}")
+        kinds[name] = op['op']
+        ops.append(op)
+
+    program = {
+        'input': input_name,
+        'ops': ops,
+        'outputs': [renamed.get(output[0], output[0]) for output in config['output_layers']],
+    }
+    with open(filepath, 'wb') as f:
+        np.savez(f, program=np.array(json.dumps(program)), **weights)
+
+
+def getBatchNormAffine(layer_config, params):
+    """Returns the per-channel (scale, shift) a BatchNormalization layer applies at inference."""
+    params = list(params)
+    gamma = params.pop(0) if layer_config['scale'] else 1.
+    beta = params.pop(0) if layer_config['center'] else 0.
+    mean, variance = params
+    scale = (gamma / np.sqrt(variance + layer_config['epsilon'])).astype(np.float32)
+    return scale, (beta - mean * scale).astype(np.float32)
+
+
+def conv2d(x, kernel, bias, padding='same'):
+    """
+    Input:
+        x: a (batch, height, width, channels) array
+        kernel: a (kernel_height, kernel_width, channels, filters) array
+        bias: a (filters,) array
+        padding: 'same' or 'valid', as in Keras
+    Returns the convolution of x with stride 1, computed as one matrix product
+    of the image patches (im2col) with the kernel.
+    """
+    kh, kw, channels, filters = kernel.shape
+    if padding == 'same':
+        # as in TensorFlow, odd padding puts the extra row and column at the end
+        x = np.pad(x, ((0, 0), ((kh - 1) // 2, kh // 2), ((kw - 1) // 2, kw // 2), (0, 0)))
+    windows = sliding_window_view(x, (kh, kw), axis=(1, 2))  # (batch, h, w, channels, kh, kw)
+    batch, height, width = windows.shape[:3]
+    cols = windows.transpose(0, 1, 2, 4, 5, 3).reshape(batch * height * width, kh * kw * channels)
+    out = cols @ kernel.reshape(kh * kw * channels, filters) + bias
+    return out.reshape(batch, height, width, filters)
+
+
+def softmax(x):
+    e = np.exp(x - x.max(axis=-1, keepdims=True))
+    return e / e.sum(axis=-1, keepdims=True)
+
+
+class NumpyNet(Evaluator):
+    """
+    Evaluates boards with a network saved by NeuralNet.export_checkpoint,
+    using only NumPy. It stands in for NeuralNet in worker processes, which
+    then neither build the Keras model nor run TensorFlow.
+    """
+
+    activations = {
+        'linear': lambda x: x,
+        'relu': lambda x: np.maximum(x, 0),
+        'tanh': np.tanh,
+        'softmax': softmax,
+    }
+
+    def __init__(self, game: Game, config: Config = None):
+        super().__init__(game, config or Config())
+        self.program = None
+        self.weights = {}
+
+    def predictStates(self, states):
+        """
+        Input:
+            states: a numpy array of board states in their canonical form, of
+                    shape (batch, board_y, board_x).
+        Returns:
+            pis: a numpy array of policy vectors, one row per state
+            vs: a numpy array with the value of each state
+        """
+        values = {self.program['input']: np.asarray(states, dtype=np.float32)}
+        for op in self.program['ops']:
+            values[op['name']] = self.__run(op, [values[name] for name in op['inputs']])
+        pis, vs = (values[name] for name in self.program['outputs'])
+        return pis, vs[:, 0]
+
+    def __run(self, op, inputs):
+        kind, name = op['op'], op['name']
+        if kind == 'reshape':
+            return inputs[0].reshape((len(inputs[0]),) + tuple(op['shape']))
+        if kind == 'conv':
+            return conv2d(inputs[0], self.weights[name + '/kernel'],
+                          self.weights[name + '/bias'], op['padding'])
+        if kind == 'affine':
+            return inputs[0] * self.weights[name + '/scale'] + self.weights[name + '/shift']
+        if kind == 'add':
+            return sum(inputs[1:], inputs[0])
+        if kind == 'flatten':
+            return inputs[0].reshape(len(inputs[0]), -1)
+        if kind == 'dense':
+            out = inputs[0] @ self.weights[name + '/kernel'] + self.weights[name + '/bias']
+            return self.activations[op['activation']](out)
+        return self.activations[kind](inputs[0])
+
+    def load_checkpoint(self, folder, filename, suppress=False):
+        """
+        Loads a network saved by NeuralNet.export_checkpoint from folder/filename
+        """
+        filepath = os.path.join(folder, filename)
+        with np.load(filepath) as data:
+            self.program = json.loads(str(data['program']))
+            self.weights = {key: data[key] for key in data.files if key != 'program'}
+        self.clearCache()
+        if not suppress:
+            print('Loading Weights...')
@@ -0,0 +1,149 @@
+#!/usr/bin/python
+import copy
+from collections import deque
+from Game import Game
+from Board import Board
+from Config import Config
+import numpy as np
+
+"""
+use this script to build the opening book of config.openingBook, with a deep
+MCTS of the network in config.load_folder_file, or with the solver.
+"""
+
+use_solver = False  # the solver only finishes in time for deep plies
+
+
+class OpeningBook():
+    """
+    Move statistics of the positions of the first plies, read from a file
+    holding a numpy structured array of keys (see Game.getPositionKey),
+    policies and values, sorted by key. The file is memory mapped, and a
+    lookup is a binary search on the keys.
+    Mirror images share one entry, stored for their symmetric form (see
+    Game.getSymmetricForm).
+    """
+
+    def __init__(self, game: Game, filepath):
+        self.game = game
+        self.entries = np.load(filepath, mmap_mode='r')
+        self.keys = self.entries['key']
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def getDtype(game: Game):
+        return np.dtype([('key', np.uint64),
+                         ('pi', np.float16, (game.getActionSize(),)),
+                         ('v', np.float16)])
+
+    def lookup(self, canonicalBoard: Board):
+        """
+        Returns (pi, v) of canonicalBoard, pi as a float numpy array, or None
+        if the board is not in the book.
+        """
+        board, mirrored = self.game.getSymmetricForm(canonicalBoard)
+        key = np.uint64(self.game.getPositionKey(board))
+        i = np.searchsorted(self.keys, key)
+        if i == len(self.keys) or self.keys[i] != key:
+            return None
+        pi = self.entries['pi'][i].astype(float)
+        return (pi[::-1] if mirrored else pi), float(self.entries['v'][i])
+
+    def getPlayer(self, player, depth):
+        """
+        Returns an arena player that plays the most likely book move in the
+        first depth plies, and asks player otherwise.
+        """
+        def play(board: Board):
+            entry = self.lookup(board) if board.move_count < depth else None
+            if entry is None:
+                return player(board)
+            return int(np.argmax(entry[0]))
+        return play
+
+    @staticmethod
+    def build(game: Game, depth, policy, filepath):
+        """
+        Saves the book of all positions reachable in fewer than depth plies
+        to filepath. policy(board) returns the (pi, v) of a canonical board, or
+        None to leave the board out of the book.
+        Returns:
+            entries: the number of positions in the book
+        """
+        entries = {}
+        queue = deque([game.getInitBoard()])
+        seen = set()
+        while queue:
+            board, _ = game.getSymmetricForm(queue.popleft())
+            key = game.getPositionKey(board)
+            if key in seen or game.getWinState(board, 1) != 0:
+                continue
+            seen.add(key)
+            result = policy(board)
+            if result is not None:
+                entries[key] = result
+            if board.move_count + 1 < depth:
+                for a in np.nonzero(game.getValidMoves(board))[0]:
+                    next_board, next_player = game.getNextState(board, 1, a)
+                    queue.append(game.getCanonicalForm(next_board, next_player))
+
+        book = np.zeros(len(entries), dtype=OpeningBook.getDtype(game))
+        book['key'] = sorted(entries)
+        for i, key in enumerate(book['key']):
+            book['pi'][i], book['v'][i] = entries[int(key)]
+        with open(filepath, 'wb') as f:
+            np.save(f, book)
+        return len(book)
+
+
+def searchPolicy(game: Game, nnet, config: Config):
+    """
+    Returns a book policy giving the MCTS visit counts and root value of a
+    fresh search with config.numMCTSSims simulations. The searches do not
+    consult config.openingBook, which is usually the book being built.
+    """
+    from MCTS import MCTS
+    config = copy.copy(config)
+    config.openingBook = None
+
+    def policy(board: Board):
+        mcts = MCTS(game, nnet, config)
+        pi = mcts.getActionProb(board, temp=1)
+        return pi, mcts.getRootValue(board)
+    return policy
+
+
+def solverPolicy(solver, max_nodes=None):
+    """
+    Returns a book policy spreading the probability over the moves with the
+    best solver score, with the sign of that score as value. Boards the
+    solver can not solve within max_nodes positions per move are left out.
+    """
+    def policy(board: Board):
+        scores = solver.getMoveScores(board, weak=True, max_nodes=max_nodes)
+        valid = [score for score in scores if score is not None]
+        if len(valid) < sum(board.column_heights[col] < board.height for col in range(board.width)):
+            return None
+        best = max(valid)
+        pi = np.array([score == best for score in scores], dtype=float)
+        return pi / pi.sum(), best
+    return policy
+
+
+if __name__ == "__main__":
+    g = Game()
+    config = Config()
+    filepath = config.openingBook or './temp/book.npy'
+    if use_solver:
+        from Solver import Solver
+        policy = solverPolicy(Solver(), max_nodes=1000000)
+    else:
+        from Evaluator import makeEvaluator
+        nnet = makeEvaluator(g, config.load_folder_file[1])
+        nnet.load_checkpoint(*config.load_folder_file)
+        config.numMCTSSims *= 20  # deeper than the searches the book replaces
+        policy = searchPolicy(g, nnet, config)
+    size = OpeningBook.build(g, config.openingBookDepth, policy, filepath)
+    print(f'{size} positions of the first {config.openingBookDepth} plies saved to {filepath}')
@@ -1,7 +1,8 @@
 #!/usr/bin/python
 import Arena
 from Game import Game
-from NeuralNet import NeuralNet as NNet
+from Evaluator import makeEvaluator
+from OpeningBook import OpeningBook
 import numpy as np
 from HumanPlayer import HumanPlayer
 
@@ -11,19 +12,23 @@ any agent.
 """
 
 human_vs_cpu = True
+opening_book = None  # e.g. ('./temp/book.npy', 4) to play the book for the first 4 plies
 
 g = Game()
 
-# nnet players
-n1 = NNet(g)
-n1.load_checkpoint('./models/','checkpoint_38.pth.tar')
+# nnet players, a .npz file from NeuralNet.export_checkpoint plays without TensorFlow
+checkpoint = ('./models/', 'checkpoint_38.pth.tar')
+n1 = makeEvaluator(g, checkpoint[1])
+n1.load_checkpoint(*checkpoint)
 n1p = lambda x: np.argmax(n1.predict(x)[0])
+if opening_book is not None:
+    n1p = OpeningBook(g, opening_book[0]).getPlayer(n1p, opening_book[1])
 
 if human_vs_cpu:
     player2 = HumanPlayer(g).play
 else:
-    n2 = NNet(g)
-    n2.load_checkpoint('./models/','checkpoint_38.pth.tar')
+    n2 = makeEvaluator(g, checkpoint[1])
+    n2.load_checkpoint(*checkpoint)
     n2p = lambda x: np.argmax(n2.predict(x))
     player2 = n2p  # Player 2 is neural network if it's cpu vs cpu.
 
@@ -0,0 +1,43 @@
+#!/usr/bin/python
+from Game import Game
+from NeuralNet import NeuralNet
+import numpy as np
+import time
+
+"""
+use this script to compare the latency and throughput of the compiled
+NeuralNet.predictStates with calling the Keras model eagerly, as
+NeuralNet.predict used to.
+"""
+
+
+def eagerPredict(nnet: NeuralNet, states):
+    pis, vs = nnet.nnet.model(states, training=False)
+    return np.asarray(pis), np.asarray(vs)[:, 0]
+
+
+def compiledPredict(nnet: NeuralNet, states):
+    return nnet.predictStates(states)
+
+
+def secondsPerCall(predict, nnet: NeuralNet, states, calls=200):
+    """Returns the mean seconds of predict(nnet, states) after a warm up call."""
+    predict(nnet, states)
+    start = time.perf_counter()
+    for _ in range(calls):
+        predict(nnet, states)
+    return (time.perf_counter() - start) / calls
+
+
+if __name__ == "__main__":
+    g = Game()
+    nnet = NeuralNet(g)
+    board_x, board_y = g.getBoardSize()
+
+    for batch_size in [1, 8, 64]:
+        # float64 boards, as built from Board.state
+        states = np.random.randint(-1, 2, size=(batch_size, board_y, board_x)).astype(float)
+        for name, predict in [('eager', eagerPredict), ('compiled', compiledPredict)]:
+            seconds = secondsPerCall(predict, nnet, states)
+            print(f'{name:8s} batch {batch_size:2d}: {seconds * 1000:7.3f} ms/call, '
+                  f'{batch_size / seconds:9.1f} boards/sec')
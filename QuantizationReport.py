@@ -0,0 +1,79 @@
+#!/usr/bin/python
+import os
+from Arena import Arena
+from Game import Game
+from NeuralNet import NeuralNet
+from QuantizedNet import QuantizedNet
+from ReplayBuffer import ReplayBuffer
+from Config import Config
+from MCTS import MCTS
+import numpy as np
+
+"""
+use this script to compare the int8 quantized network of
+config.quantizedInference with the float network it is made from. The model
+is loaded from config.load_folder_file, and the positions come from the replay
+buffer in config.checkpoint.
+"""
+
+
+def policyKL(pis, quantized_pis, eps=1e-8):
+    """Returns the mean KL divergence of the quantized policies from the float policies."""
+    return np.mean(np.sum(pis * (np.log(pis + eps) - np.log(quantized_pis + eps)), axis=1))
+
+
+def mctsPlayer(game: Game, nnet, config: Config, random_moves):
+    """
+    Returns a player that samples its first random_moves moves of a game from
+    the MCTS policy and then plays the move with the most visits, so that the
+    arena games do not all repeat the same game.
+    """
+    mcts = MCTS(game, nnet, config)
+
+    def play(board):
+        temp = int(np.count_nonzero(board.state) < random_moves)
+        pi = mcts.getActionProb(board, temp=temp)
+        return np.random.choice(len(pi), p=pi)
+    return play
+
+
+def accuracyReport(game: Game, nnet: NeuralNet, qnet: QuantizedNet, states, config: Config,
+                   games=200, random_moves=8):
+    """
+    Returns the policy KL divergence and value mean squared error of qnet
+    against nnet on states, and the share of the arena games qnet wins, with
+    draws counted as half.
+    """
+    pis, vs = nnet.predictStates(states)
+    quantized_pis, quantized_vs = qnet.predictStates(states)
+
+    arena = Arena(mctsPlayer(game, qnet, config, random_moves),
+                  mctsPlayer(game, nnet, config, random_moves), game)
+    qwins, fwins, draws = arena.playGames(games)
+    return {
+        'policyKL': policyKL(pis, quantized_pis),
+        'valueMSE': np.mean((vs - quantized_vs) ** 2),
+        'arenaScore': (qwins + draws / 2) / (qwins + fwins + draws),
+    }
+
+
+if __name__ == "__main__":
+    g = Game()
+    config = Config()
+    nnet = NeuralNet(g)
+    nnet.load_checkpoint(*config.load_folder_file)
+
+    replay_buffer = ReplayBuffer(os.path.join(config.checkpoint, 'replay'),
+                                 config.numItersForTrainExamplesHistory)
+    replay_buffer.open()
+    states = replay_buffer.getSample(2 * config.quantizationSamples)['board']
+    calibration_states, test_states = np.split(states, [len(states) // 2])
+
+    nnet.export_quantized(config.checkpoint, 'quantized.tflite', calibration_states)
+    qnet = QuantizedNet(g)
+    qnet.load_checkpoint(config.checkpoint, 'quantized.tflite')
+
+    report = accuracyReport(g, nnet, qnet, test_states, config)
+    print(f'policy KL divergence: {report["policyKL"]:.5f}')
+    print(f'value MSE:            {report["valueMSE"]:.5f}')
+    print(f'quantized arena score against float: {report["arenaScore"]:.1%}')
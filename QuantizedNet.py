@@ -0,0 +1,63 @@
+#!/usr/bin/python
+import os
+from Config import Config
+from Game import Game
+from Evaluator import Evaluator
+import numpy as np
+
+
+class QuantizedNet(Evaluator):
+    """
+    Evaluates boards with an int8 TFLite model saved by
+    NeuralNet.export_quantized. It uses tflite_runtime when it is installed,
+    and TensorFlow's interpreter otherwise.
+    """
+
+    def __init__(self, game: Game, config: Config = None):
+        super().__init__(game, config or Config())
+        self.interpreter = None
+        self.batch_size = None  # batch size the interpreter's tensors are allocated for
+
+    def predictStates(self, states):
+        """
+        Input:
+            states: a numpy array of board states in their canonical form, of
+                    shape (batch, board_y, board_x).
+        Returns:
+            pis: a numpy array of policy vectors, one row per state
+            vs: a numpy array with the value of each state
+        """
+        states = np.asarray(states, dtype=np.float32)
+        if len(states) != self.batch_size:
+            self.interpreter.resize_tensor_input(self.input_index, states.shape)
+            self.interpreter.allocate_tensors()
+            self.batch_size = len(states)
+        self.interpreter.set_tensor(self.input_index, states)
+        self.interpreter.invoke()
+        pis = self.interpreter.get_tensor(self.pi_index)
+        vs = self.interpreter.get_tensor(self.v_index)
+        return pis.copy(), vs[:, 0].copy()
+
+    def load_checkpoint(self, folder, filename, suppress=False):
+        """
+        Loads a model saved by NeuralNet.export_quantized from folder/filename
+        """
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+
+        self.interpreter = Interpreter(model_path=os.path.join(folder, filename))
+        self.interpreter.allocate_tensors()
+        self.batch_size = self.interpreter.get_input_details()[0]['shape'][0]
+        self.input_index = self.interpreter.get_input_details()[0]['index']
+        for output in self.interpreter.get_output_details():
+            # the value head has a single output
+            if output['shape'][-1] == 1:
+                self.v_index = output['index']
+            else:
+                self.pi_index = output['index']
+        self.clearCache()
+        if not suppress:
+            print('Loading Weights...')
@@ -0,0 +1,145 @@
+#!/usr/bin/python
+import os
+import re
+import numpy as np
+
+
+class ReplayBuffer():
+    """
+    Stores the self-play examples of the latest max_shards iterations on disk.
+    Every iteration is one append-only shard of three .npy files in folder:
+    int8 boards, float16 policies and float32 values. Shards are opened as
+    read-only memory maps, so opening the buffer only reads the file headers,
+    and old shards are retired by deleting their files.
+    """
+
+    def __init__(self, folder, max_shards):
+        self.folder = folder
+        self.max_shards = max_shards
+        self.shards = []  # (iteration, boards, pis, vs) of every shard, oldest first
+
+    def __len__(self):
+        return sum(len(vs) for _, _, _, vs in self.shards)
+
+    def getShardFile(self, iteration, part):
+        return os.path.join(self.folder, f'shard_{iteration}.{part}.npy')
+
+    def getIterations(self):
+        """Returns the iterations of the shards in folder, oldest first."""
+        if not os.path.isdir(self.folder):
+            return []
+        # the values are written last, so they mark complete shards
+        matches = [re.fullmatch(r'shard_(\d+)\.vs\.npy', f) for f in os.listdir(self.folder)]
+        return sorted(int(m.group(1)) for m in matches if m)
+
+    def hasShard(self, iteration):
+        return os.path.isfile(self.getShardFile(iteration, 'vs'))
+
+    def open(self, last_iteration=None):
+        """
+        Opens the latest max_shards shards in folder, ignoring the shards of
+        iterations after last_iteration if it is given.
+        """
+        iterations = [i for i in self.getIterations()
+                      if last_iteration is None or i <= last_iteration]
+        self.shards = [self.__open_shard(i) for i in iterations[-self.max_shards:]]
+
+    def add(self, iteration, examples):
+        """
+        Writes the examples of an iteration as a new shard and retires the
+        oldest shards beyond max_shards.
+        Input:
+            examples: a structured array of examples, see Game.getExamples
+        """
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+        self.__save(iteration, 'boards', examples['board'].astype(np.int8))
+        self.__save(iteration, 'pis', examples['pi'].astype(np.float16))
+        self.__save(iteration, 'vs', examples['v'].astype(np.float32))
+
+        self.shards = [shard for shard in self.shards if shard[0] != iteration]
+        self.shards.append(self.__open_shard(iteration))
+        self.retire()
+
+    def retire(self):
+        """Deletes the shards of all but the latest max_shards iterations."""
+        iterations = self.getIterations()
+        if len(iterations) <= self.max_shards:
+            return
+        retired = set(iterations[:-self.max_shards])
+        self.shards = [shard for shard in self.shards if shard[0] not in retired]
+        for iteration in retired:
+            # values first, so that a partly deleted shard is no longer listed
+            for part in ('vs', 'pis', 'boards'):
+                os.remove(self.getShardFile(iteration, part))
+
+    def getExamples(self):
+        """
+        Reads all open shards.
+        Returns:
+            examples: a structured array of the examples, see Game.getExamples,
+                      or None if no shard is open
+        """
+        if not self.shards:
+            return None
+        examples = np.zeros(len(self), dtype=self.__get_dtype(*self.shards[0][1:]))
+        start = 0
+        for _, boards, pis, vs in self.shards:
+            end = start + len(vs)
+            examples['board'][start:end] = boards
+            examples['pi'][start:end] = pis
+            examples['v'][start:end] = vs
+            start = end
+        return examples
+
+    def getSample(self, num):
+        """
+        Returns a structured array of num examples drawn uniformly without
+        replacement from the open shards, or all of them if there are fewer.
+        """
+        indices = np.sort(np.random.permutation(len(self))[:num])
+        examples = np.zeros(len(indices), dtype=self.__get_dtype(*self.shards[0][1:]))
+        start = 0
+        for _, boards, pis, vs in self.shards:
+            end = start + len(vs)
+            selected = (indices >= start) & (indices < end)
+            shard_indices = indices[selected] - start
+            examples['board'][selected] = boards[shard_indices]
+            examples['pi'][selected] = pis[shard_indices]
+            examples['v'][selected] = vs[shard_indices]
+            start = end
+        return examples
+
+    def getChunks(self, chunk_size):
+        """
+        Yields the examples of all open shards as structured arrays of up to
+        chunk_size consecutive examples, with the chunks in a random order.
+        Only one chunk is read into memory at a time.
+        """
+        chunks = [(shard, start) for shard in self.shards
+                  for start in range(0, len(shard[3]), chunk_size)]
+        for i in np.random.permutation(len(chunks)):
+            (_, boards, pis, vs), start = chunks[i]
+            end = start + chunk_size
+            examples = np.zeros(len(vs[start:end]), dtype=self.__get_dtype(boards, pis, vs))
+            examples['board'] = boards[start:end]
+            examples['pi'] = pis[start:end]
+            examples['v'] = vs[start:end]
+            yield examples
+
+    def __get_dtype(self, boards, pis, vs):
+        return np.dtype([('board', boards.dtype, boards.shape[1:]),
+                         ('pi', pis.dtype, pis.shape[1:]),
+                         ('v', vs.dtype)])
+
+    def __save(self, iteration, part, array):
+        # written next to the shard and renamed, so that memory maps of a
+        # replaced shard keep their file
+        filename = self.getShardFile(iteration, part)
+        with open(filename + '.tmp', 'wb') as f:
+            np.save(f, array)
+        os.replace(filename + '.tmp', filename)
+
+    def __open_shard(self, iteration):
+        return (iteration,) + tuple(np.load(self.getShardFile(iteration, part), mmap_mode='r')
+                                    for part in ('boards', 'pis', 'vs'))
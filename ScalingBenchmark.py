@@ -0,0 +1,121 @@
+#!/usr/bin/python
+import json
+import os
+import tempfile
+from Game import Game
+from Config import Config
+from Coach import Coach
+import numpy as np
+
+"""
+use this script to measure how the whole Coach pipeline scales with the
+number of self-play processes: games per hour, positions and network
+evaluations per second, and the seconds of self-play, training, checkpoint
+I/O and arena of an iteration, without multiprocessing and for every count in
+processes_counts. Every run starts from the same randomly initialized small
+network and a fixed config, and the table is saved to results_file.
+"""
+
+seed = 0
+processes_counts = [1, 2, 4, 8]  # counts above os.cpu_count() are skipped
+iterations = 3
+warmup_iterations = 1  # iterations left out of the averages, they include starting the workers
+results_file = './temp/scaling.json'
+
+
+def benchmarkConfig(folder, multiprocessing, processes=1):
+    """Returns the fixed small config of a run, checkpointing to folder."""
+    config = Config()
+    config.num_channels = 32
+    config.num_residual_layers = 2
+    config.numMCTSSims = 25
+    config.numEps = 16
+    config.numIters = iterations
+    config.iterationNum = None
+    config.load_model = False
+    config.epochs = 1
+    config.arenaCompare = 8
+    config.checkpoint = folder
+    config.multiprocessing = multiprocessing
+    config.processes = processes
+    return config
+
+
+def makeNet(game: Game, config: Config):
+    """Returns a NeuralNet of config with random weights, seeded with seed."""
+    import tensorflow as tf
+    from NeuralNet import NeuralNet
+    tf.random.set_seed(seed)
+    return NeuralNet(game, config)
+
+
+def runPipeline(multiprocessing, processes=1):
+    """
+    Runs Coach.learn for iterations iterations in a new checkpoint folder and
+    returns its iterationStats.
+    """
+    with tempfile.TemporaryDirectory() as folder:
+        config = benchmarkConfig(folder, multiprocessing, processes)
+        np.random.seed(seed)
+        game = Game()
+        coach = Coach(game, makeNet(game, config), config)
+        coach.learn()
+        return coach.iterationStats
+
+
+def summarize(iterationStats):
+    """
+    Returns the throughput and the mean phase seconds of the iterations after
+    warmup_iterations. Network evaluations are the boards the self-play
+    networks, or the inference server, evaluated.
+    """
+    stats = iterationStats[warmup_iterations:] or iterationStats
+    selfPlayTime = sum(s['selfPlayTime'] for s in stats)
+    phases = ['selfPlayTime', 'trainTime', 'checkpointTime', 'arenaTime']
+    summary = {
+        'gamesPerHour': 3600 * sum(s['games'] for s in stats) / selfPlayTime,
+        'positionsPerSec': sum(s['examples'] for s in stats) / selfPlayTime,
+        'evaluationsPerSec': sum(s['evaluations'] for s in stats) / selfPlayTime,
+        'iterationTime': sum(s[phase] for s in stats for phase in phases) / len(stats),
+    }
+    for phase in phases:
+        summary[phase] = sum(s[phase] for s in stats) / len(stats)
+    return summary
+
+
+def printTable(rows):
+    print(f'{"workers":>12s} {"games/h":>9s} {"pos/s":>8s} {"evals/s":>9s} {"speedup":>8s} '
+          f'{"self play":>10s} {"training":>9s} {"I/O":>7s} {"arena":>7s} {"iteration":>10s}')
+    base = rows[0]['gamesPerHour']
+    for row in rows:
+        print(f'{row["workers"]:>12s} {row["gamesPerHour"]:9.0f} {row["positionsPerSec"]:8.1f} '
+              f'{row["evaluationsPerSec"]:9.1f} {row["gamesPerHour"] / base:7.2f}x '
+              f'{row["selfPlayTime"]:9.1f}s {row["trainTime"]:8.1f}s {row["checkpointTime"]:6.1f}s '
+              f'{row["arenaTime"]:6.1f}s {row["iterationTime"]:9.1f}s')
+
+
+def runScaling():
+    """
+    Runs the pipeline without multiprocessing and with every count of
+    processes_counts, prints the scaling table and saves it to results_file.
+    Returns the rows of the table.
+    """
+    runs = [(False, 1)] + [(True, processes) for processes in processes_counts
+                           if processes <= os.cpu_count()]
+    rows = []
+    for multiprocessing, processes in runs:
+        row = summarize(runPipeline(multiprocessing, processes))
+        row['workers'] = f'{processes} processes' if multiprocessing else 'sequential'
+        row['multiprocessing'] = multiprocessing
+        row['processes'] = processes
+        rows.append(row)
+
+    printTable(rows)
+    os.makedirs(os.path.dirname(results_file), exist_ok=True)
+    with open(results_file, 'w') as f:
+        json.dump({'cpus': os.cpu_count(), 'seed': seed, 'runs': rows}, f, indent=2)
+    return rows
+
+
+if __name__ == "__main__":
+    runScaling()
@@ -0,0 +1,40 @@
+#!/usr/bin/python
+from Game import Game
+from NeuralNet import NeuralNet
+from Config import Config
+from MCTS import MCTS
+import numpy as np
+import time
+
+"""
+use this script to compare MCTS simulations per second for different
+config.mctsBatchSize values.
+"""
+
+
+def simsPerSecond(game: Game, nnet: NeuralNet, config: Config, moves=10):
+    """
+    Plays up to moves moves of a game with a fresh MCTS and returns the number of
+    simulations per second.
+    """
+    mcts = MCTS(game, nnet, config)
+    board, curPlayer = game.getInitBoard(), 1
+    played = 0
+    start = time.perf_counter()
+    while played < moves and game.getWinState(board, curPlayer) == 0:
+        canonicalBoard = game.getCanonicalForm(board, curPlayer)
+        action = np.argmax(mcts.getActionProb(canonicalBoard, temp=0))
+        board, curPlayer = game.getNextState(board, curPlayer, action)
+        played += 1
+    return played * config.numMCTSSims / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    g = Game()
+    config = Config()
+    config.numMCTSSims = 200
+    nnet = NeuralNet(g)
+
+    for batch_size in [1, 2, 4, 8, 16, 32, 64]:
+        config.mctsBatchSize = batch_size
+        print(f'batch size {batch_size:3d}: {simsPerSecond(g, nnet, config):8.1f} sims/sec')
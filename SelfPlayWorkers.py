@@ -0,0 +1,207 @@
+#!/usr/bin/python
+from Game import Game
+from Config import Config
+from MCTS import MCTS
+from Evaluator import makeEvaluator
+from InferenceServer import InferenceServer, InferenceClient
+import numpy as np
+import queue
+import time
+import traceback
+from multiprocessing import Process, Queue
+
+
+class WorkerError(Exception):
+    """Raised in the parent when a self-play worker failed or died."""
+
+
+def executeEpisode(game: Game, mcts: MCTS, config: Config):
+    """
+    This function executes one episode of self-play, starting with player 1.
+    As the game is played, each turn is added as a training example to
+    trainExamples. The game is played till the game ends. After the game
+    ends, the outcome of the game is used to assign values to each example
+    in trainExamples.
+    It uses a temp=1 if episodeStep < tempThreshold, and thereafter
+    uses temp=0.
+    Returns:
+        trainExamples: the examples (canonicalBoard, pi, v) packed by game.getExamples
+                        pi is the MCTS informed policy vector, v is +1 if
+                        the player eventually won the game, else -1.
+    """
+    trainExamples = []
+    board = game.getInitBoard()
+    curPlayer = 1
+    episodeStep = 0
+
+    while True:
+        episodeStep += 1
+        canonicalBoard = game.getCanonicalForm(board, curPlayer)
+        temp = int(episodeStep < config.tempThreshold)
+
+        pi = mcts.getActionProb(canonicalBoard, temp=temp)
+        # the mirror image is added while training, see Game.getExampleSymmetries
+        trainExamples.append([canonicalBoard.state, curPlayer, pi, None])
+
+        action = np.random.choice(len(pi), p=pi)
+        board, curPlayer = game.getNextState(
+            board, curPlayer, action)
+
+        r = game.getWinState(board, curPlayer)
+
+        if r != 0:
+            return game.getExamples(
+                [(x[0], x[2], r * ((-1) ** (x[1] != curPlayer))) for x in trainExamples])
+
+
+def selfPlayWorker(worker_id, config: Config, tasks: Queue, results: Queue, inference=None):
+    """
+    Runs in a self-play process until it takes None from tasks. Every other
+    task is the model generation to play one episode with. The network is
+    built on the first task, and temp.pth.tar is only reloaded when the
+    generation changes. Puts (trainExamples, info) on results for each
+    episode, where info holds the seconds spent building or loading the
+    network before it ('setupTime'), the evaluation cache and network stats
+    of the episode (see Evaluator.getCacheStats and getInferenceStats), and
+    its opening book and search stats (see MCTS.getBookStats and
+    getSearchStats).
+    inference is the (requests, responses) pair of an InferenceServer. If it
+    is given, the worker sends its positions there instead of building a
+    network. Otherwise, with config.quantizedInference, the worker runs a
+    QuantizedNet loaded from temp.tflite, or with config.numpyInference, a
+    NumpyNet loaded from temp.npz.
+    If the episode raises an exception, a WorkerError with its traceback is
+    put on results instead, and the worker exits.
+    """
+    game = Game()
+    np.random.seed()  # forked workers would otherwise share the random state
+    if inference is not None:
+        nnet = InferenceClient(worker_id, *inference)
+    else:
+        nnet = None
+    generation = None
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        try:
+            start = time.perf_counter()
+            if inference is None and task != generation:
+                if config.quantizedInference:
+                    filename = 'temp.tflite'
+                elif config.numpyInference:
+                    filename = 'temp.npz'
+                else:
+                    filename = 'temp.pth.tar'
+                # only workers loading temp.pth.tar import TensorFlow
+                nnet = nnet or makeEvaluator(game, filename, config)
+                nnet.load_checkpoint(folder=config.checkpoint, filename=filename, suppress=True)
+                generation = task
+            info = {'setupTime': time.perf_counter() - start}
+
+            mcts = MCTS(game, nnet, config)
+            if inference is None:
+                nnet.resetCacheStats()
+            trainExamples = executeEpisode(game, mcts, config)
+            if inference is None:
+                info.update(nnet.getCacheStats())
+                info.update(nnet.getInferenceStats())
+            info.update(mcts.getBookStats())
+            info.update(mcts.getSearchStats())
+            results.put((trainExamples, info))
+        except Exception:
+            results.put(WorkerError(f'self-play worker {worker_id} failed:\n{traceback.format_exc()}'))
+            break
+
+
+class SelfPlayWorkers():
+    """
+    config.processes long lived self-play processes. The workers keep their
+    network between episodes and iterations, and only reload its weights when
+    a new model generation is published.
+    If config.inferenceServer is set, the workers share the network of one
+    InferenceServer instead.
+    """
+
+    def __init__(self, config: Config):
+        self.config = config
+        self.tasks = Queue()
+        self.results = Queue()
+        self.generation = None  # last published model generation
+        self.inferenceServer = None
+        self.workers = []
+
+    def publish(self, nnet, generation, calibrationStates=None):
+        """
+        Saves the NeuralNet nnet to temp.pth.tar as the model of the next episodes, and
+        starts the workers on the first call. With config.quantizedInference,
+        it is also quantized to temp.tflite using calibrationStates, and with
+        config.numpyInference, exported to temp.npz.
+        Returns:
+            seconds: time the inference server spent loading the model, 0 if
+                     there is no inference server
+        """
+        nnet.save_checkpoint(folder=self.config.checkpoint, filename='temp.pth.tar')
+        if self.config.quantizedInference:
+            nnet.export_quantized(folder=self.config.checkpoint, filename='temp.tflite',
+                                  states=calibrationStates)
+        if self.config.numpyInference:
+            nnet.export_checkpoint(folder=self.config.checkpoint, filename='temp.npz')
+        self.generation = generation
+        setup_time = 0.
+        if self.workers:
+            if self.inferenceServer is not None:
+                setup_time = self.inferenceServer.reload()
+            return setup_time
+
+        inference = None
+        if self.config.inferenceServer:
+            self.inferenceServer = InferenceServer(self.config, self.config.processes)
+            setup_time = self.inferenceServer.start()
+            inference = (self.inferenceServer.requests, self.inferenceServer.responses)
+        self.workers = [Process(target=selfPlayWorker, args=(
+            worker_id, self.config, self.tasks, self.results, inference), daemon=True)
+            for worker_id in range(self.config.processes)]
+        for worker in self.workers:
+            worker.start()
+        return setup_time
+
+    def playEpisodes(self, num):
+        """
+        Plays num episodes with the last published model.
+        Yields (trainExamples, info) for each episode as soon as it is
+        finished, see selfPlayWorker. Raises a WorkerError if a worker fails
+        or dies.
+        """
+        for _ in range(num):
+            self.tasks.put(self.generation)
+        for _ in range(num):
+            yield self.getResult()
+
+    def getResult(self, poll=1.):
+        """
+        Returns the next result of the workers, checking every poll seconds
+        that none of them died while waiting.
+        """
+        while True:
+            try:
+                result = self.results.get(timeout=poll)
+            except queue.Empty:
+                for worker in self.workers:
+                    if not worker.is_alive():
+                        raise WorkerError(f'self-play worker exited with code {worker.exitcode}')
+                continue
+            if isinstance(result, WorkerError):
+                raise result
+            return result
+
+    def stop(self):
+        for _ in self.workers:
+            self.tasks.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+        if self.inferenceServer is not None:
+            self.inferenceServer.stop()
+            self.inferenceServer = None
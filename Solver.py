@@ -0,0 +1,233 @@
+#!/usr/bin/python
+from Board import Board
+from Game import Game
+
+
+class NodeBudgetExceeded(Exception):
+    pass
+
+
+class Solver():
+    """
+    Connect 4 solver using negamax with alpha-beta pruning on the bitboards of
+    Board, based on http://blog.gamesolver.org.
+    Positions are given as a current player bitboard, the bitboard of all
+    pieces, and the number of moves played. Moves are searched center first,
+    then by the number of lines they threaten, and a transposition table
+    keeps an upper bound of the score of every searched position. solve runs
+    null window searches that narrow the score down, which is the iterative
+    deepening of the score bounds.
+    A score is positive if the player to move wins: the earlier the win, the
+    higher the score. It is 0 for a draw and negative for a loss.
+    """
+
+    def __init__(self, table_size=1000000):
+        board = Board()
+        assert board.win_length == 4, "The solver only supports 4 in a row"
+        self.height = board.height
+        self.width = board.width
+        self.table_size = table_size
+        self.table = {}  # position key -> upper bound of its score
+        self.nodes = 0  # positions searched since the last resetStats
+
+        h1 = self.height + 1
+        self.bottom_mask = sum(1 << col * h1 for col in range(self.width))
+        self.board_mask = self.bottom_mask * ((1 << self.height) - 1)
+        self.column_masks = [((1 << self.height) - 1) << col * h1 for col in range(self.width)]
+        self.top_masks = [1 << (self.height - 1 + col * h1) for col in range(self.width)]
+        # center columns first
+        self.column_order = sorted(range(self.width), key=lambda col: abs(2 * col - self.width + 1))
+        self.max_nodes = None
+
+    def resetStats(self):
+        self.nodes = 0
+
+    def solve(self, board: Board, weak=False, max_nodes=None):
+        """
+        Input:
+            board: board in its canonical form, the player to move owns
+                   player1's pieces. The game must not be over.
+            weak: only find out if the game is won, drawn or lost, which is
+                  faster than finding the exact score
+            max_nodes: positions that may be searched
+        Returns:
+            score: the score of the board for the player to move, or its sign
+                   if weak. None if max_nodes positions were not enough.
+        """
+        position = board.player1_mask
+        mask = board.player1_mask | board.player2_mask
+        self.max_nodes = None if max_nodes is None else self.nodes + max_nodes
+        try:
+            return self.__solve(position, mask, board.move_count, weak)
+        except NodeBudgetExceeded:
+            return None
+
+    def getMoveScores(self, board: Board, weak=False, max_nodes=None):
+        """
+        Returns a list with the score of playing every column of a canonical
+        board for the player to move, None for the full columns. The scores
+        are None as well if max_nodes positions per move were not enough.
+        """
+        position = board.player1_mask
+        mask = board.player1_mask | board.player2_mask
+        moves = board.move_count
+        scores = [None] * self.width
+        for col in range(self.width):
+            if mask & self.top_masks[col]:
+                continue
+            move = (mask + self.bottom_mask) & self.column_masks[col]
+            if self.__winning_positions(position, mask) & move:
+                scores[col] = (self.width * self.height + 1 - moves) // 2
+                continue
+            if moves + 1 == self.width * self.height:
+                scores[col] = 0
+                continue
+            self.max_nodes = None if max_nodes is None else self.nodes + max_nodes
+            try:
+                scores[col] = -self.__solve(position ^ mask, mask | move, moves + 1, weak)
+            except NodeBudgetExceeded:
+                scores[col] = None
+        return scores
+
+    def __solve(self, position, mask, moves, weak):
+        if self.__winning_positions(position, mask) & self.__possible(mask):
+            return 1 if weak else (self.width * self.height + 1 - moves) // 2
+        if weak:
+            low, high = -1, 1
+        else:
+            low = -((self.width * self.height - moves) // 2)
+            high = (self.width * self.height + 1 - moves) // 2
+        while low < high:
+            # null window searches around the middle, biased towards 0
+            med = low + (high - low) // 2
+            if med <= 0 and int(low / 2) < med:
+                med = int(low / 2)
+            elif med >= 0 and high // 2 > med:
+                med = high // 2
+            score = self.__negamax(position, mask, moves, med, med + 1)
+            if score <= med:
+                high = score
+            else:
+                low = score
+        if weak:
+            return (low > 0) - (low < 0)
+        return low
+
+    def __negamax(self, position, mask, moves, alpha, beta):
+        """
+        Returns the score of a position if it is in [alpha, beta], an upper
+        bound if it is below, and a lower bound if it is above. The player to
+        move must not be able to win with their next move.
+        """
+        self.nodes += 1
+        if self.max_nodes is not None and self.nodes > self.max_nodes:
+            raise NodeBudgetExceeded()
+
+        candidates = self.__non_losing_moves(position, mask)
+        if candidates == 0:
+            return -((self.width * self.height - moves) // 2)
+        if moves >= self.width * self.height - 2:
+            return 0
+
+        low = -((self.width * self.height - 2 - moves) // 2)
+        if alpha < low:
+            alpha = low
+            if alpha >= beta:
+                return alpha
+        high = (self.width * self.height - 1 - moves) // 2
+        key = position + mask
+        if key in self.table:
+            high = self.table[key]
+        if beta > high:
+            beta = high
+            if alpha >= beta:
+                return beta
+
+        ordered = []
+        for col in self.column_order:
+            move = candidates & self.column_masks[col]
+            if move:
+                ordered.append((-self.__count(self.__winning_positions(position | move, mask)),
+                                len(ordered), move))
+        ordered.sort()
+
+        for _, _, move in ordered:
+            # the opponent moves next, from the position with the move played
+            score = -self.__negamax(position ^ mask, mask | move, moves + 1, -beta, -alpha)
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+
+        if len(self.table) >= self.table_size:
+            self.table.clear()
+        self.table[key] = alpha
+        return alpha
+
+    def __possible(self, mask):
+        """Returns the bitboard of the cells a piece can be played in."""
+        return (mask + self.bottom_mask) & self.board_mask
+
+    def __non_losing_moves(self, position, mask):
+        """
+        Returns the bitboard of the possible moves that do not let the
+        opponent win with their next move.
+        """
+        possible = self.__possible(mask)
+        opponent_wins = self.__winning_positions(position ^ mask, mask)
+        forced = possible & opponent_wins
+        if forced:
+            if forced & (forced - 1):
+                return 0  # the opponent has two winning moves
+            possible = forced
+        # do not play below a winning cell of the opponent
+        return possible & ~(opponent_wins >> 1)
+
+    def __winning_positions(self, position, mask):
+        """
+        Returns the bitboard of the empty cells that complete a line of 4 for
+        the player owning position.
+        """
+        # vertical
+        r = (position << 1) & (position << 2) & (position << 3)
+        # horizontal and the two diagonals
+        for shift in (self.height + 1, self.height, self.height + 2):
+            p = (position << shift) & (position << 2 * shift)
+            r |= p & (position << 3 * shift)
+            r |= p & (position >> shift)
+            p = (position >> shift) & (position >> 2 * shift)
+            r |= p & (position << shift)
+            r |= p & (position >> 3 * shift)
+        return r & (self.board_mask ^ mask)
+
+    @staticmethod
+    def __count(bits):
+        return bin(bits).count('1')
+
+
+class SolverPlayer():
+    """
+    Arena player that plays the move with the best solver score. If the
+    solver needs more than max_nodes positions for a move, the move is chosen
+    by fallback instead, or the most central valid column without one.
+    """
+
+    def __init__(self, game: Game, solver: Solver, max_nodes=None, fallback=None):
+        self.game = game
+        self.solver = solver
+        self.max_nodes = max_nodes
+        self.fallback = fallback
+
+    def play(self, board: Board):
+        valid = self.game.getValidMoves(board)
+        scores = None
+        # solving the board first fills the transposition table for the moves
+        if self.solver.solve(board, max_nodes=self.max_nodes) is not None:
+            scores = self.solver.getMoveScores(board, max_nodes=self.max_nodes)
+        if scores is None or any(score is None for score, v in zip(scores, valid) if v):
+            if self.fallback is not None:
+                return self.fallback(board)
+            return next(col for col in self.solver.column_order if valid[col])
+        # ties go to the most central column
+        return max((col for col in self.solver.column_order if valid[col]),
+                   key=lambda col: scores[col])
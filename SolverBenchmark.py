@@ -0,0 +1,77 @@
+#!/usr/bin/python
+import os
+from Game import Game
+from Config import Config
+from Solver import Solver
+from Evaluator import makeEvaluator
+from ReplayBuffer import ReplayBuffer
+from Board import Board
+import numpy as np
+import time
+
+"""
+use this script to measure the solver's solves and nodes per second on
+positions after a number of random moves, and how accurate the values of the
+network in config.load_folder_file are on replay buffer positions.
+"""
+
+
+def randomPositions(game: Game, moves, num):
+    """Returns num canonical boards reached by moves random moves, where the game is not over."""
+    boards = []
+    while len(boards) < num:
+        board, player = game.getInitBoard(), 1
+        for _ in range(moves):
+            action = np.random.choice(np.nonzero(game.getValidMoves(board))[0])
+            board, player = game.getNextState(board, player, action)
+            if game.getWinState(board, player) != 0:
+                break
+        else:
+            boards.append(game.getCanonicalForm(board, player))
+    return boards
+
+
+def solverSpeed(solver: Solver, boards):
+    """Returns the solves per second and nodes per second of solving boards."""
+    solver.resetStats()
+    start = time.perf_counter()
+    for board in boards:
+        solver.solve(board)
+    seconds = time.perf_counter() - start
+    return len(boards) / seconds, solver.nodes / seconds
+
+
+def valueAccuracy(nnet, solver: Solver, boards):
+    """
+    Returns the share of boards where the sign of the network's value matches
+    the solved outcome (values within 1/3 of 0 counting as a draw), and the
+    mean squared error of the values against the outcomes.
+    """
+    outcomes = np.array([solver.solve(board, weak=True) for board in boards])
+    _, vs = nnet.predictBatch(boards)
+    predicted = np.where(np.abs(vs) < 1 / 3, 0, np.sign(vs))
+    return np.mean(predicted == outcomes), np.mean((vs - outcomes) ** 2)
+
+
+if __name__ == "__main__":
+    g = Game()
+    config = Config()
+    solver = Solver()
+
+    for moves in [24, 20, 16, 12]:
+        solves, nodes = solverSpeed(solver, randomPositions(g, moves, 20))
+        print(f'after {moves:2d} random moves: {solves:8.2f} solves/sec, {nodes:9.0f} nodes/sec')
+
+    replay_buffer = ReplayBuffer(os.path.join(config.checkpoint, 'replay'),
+                                 config.numItersForTrainExamplesHistory)
+    replay_buffer.open()
+    if len(replay_buffer) > 0:
+        nnet = makeEvaluator(g, config.load_folder_file[1])
+        nnet.load_checkpoint(*config.load_folder_file)
+        # positions early in the game take too long to solve
+        boards = [Board(state) for state in replay_buffer.getSample(5000)['board']
+                  if np.count_nonzero(state) >= 16]
+        boards = [board for board in boards if g.getWinState(board, 1) == 0][:200]
+        accuracy, mse = valueAccuracy(nnet, solver, boards)
+        print(f'network value on {len(boards)} replay positions: '
+              f'{accuracy:.1%} correct outcomes, {mse:.3f} MSE')
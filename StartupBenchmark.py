@@ -0,0 +1,57 @@
+#!/usr/bin/python
+import json
+import os
+import subprocess
+import sys
+from Config import Config
+
+"""
+use this script to measure how long a fresh process takes to import the
+engine modules, and to get a network ready as Pit.py and the self-play
+workers do, for each checkpoint format found.
+"""
+
+MEASURE = """
+import json, resource, sys, time
+start = time.perf_counter()
+{code}
+print(json.dumps({{
+    'seconds': time.perf_counter() - start,
+    'tensorflow': 'tensorflow' in sys.modules,
+    'maxrssMB': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+}}))
+"""
+
+LOAD = """
+from Game import Game
+from Evaluator import makeEvaluator
+nnet = makeEvaluator(Game(), {filename!r})
+nnet.load_checkpoint({folder!r}, {filename!r}, suppress=True)
+"""
+
+
+def measure(code):
+    """Runs code in a new interpreter and returns its seconds, peak memory and whether it imported TensorFlow."""
+    result = subprocess.run([sys.executable, '-c', MEASURE.format(code=code)],
+                            capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode != 0:
+        return {'error': result.stderr.strip().splitlines()[-1]}
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    config = Config()
+    cases = [('import Board, Game, MCTS, Arena', 'import Board, Game, MCTS, Arena')]
+    cases.append(('Pit.py network', LOAD.format(folder='./models/', filename='checkpoint_38.pth.tar')))
+    for filename in ['temp.pth.tar', 'temp.npz', 'temp.tflite']:
+        # TensorFlow checkpoints are an index file plus data files
+        if any(f.startswith(filename) for f in os.listdir(config.checkpoint)):
+            cases.append((f'worker {filename}', LOAD.format(folder=config.checkpoint, filename=filename)))
+
+    for name, code in cases:
+        result = measure(code)
+        if 'error' in result:
+            print(f'{name:32s} failed: {result["error"]}')
+        else:
+            print(f'{name:32s} {result["seconds"]:7.2f}s {result["maxrssMB"]:7.1f} MB, '
+                  f'TensorFlow {"imported" if result["tensorflow"] else "not imported"}')
@@ -4,11 +4,31 @@ pytest-3 tests.py
 """
 
 from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+import json
+import os
+import subprocess
+import sys
 import textwrap
 import numpy as np
+import pytest
 
 from Game import Game
 from Board import Board
+from BatchGame import BatchGame
+from Arena import Arena, BatchArena
+from ReplayBuffer import ReplayBuffer
+from NumpyNet import conv2d
+from Solver import Solver
+from OpeningBook import OpeningBook, searchPolicy
+from SelfPlayWorkers import SelfPlayWorkers, WorkerError
+from InferenceServer import InferenceServer, InferenceClient
+import MicroBenchmark
+import ScalingBenchmark
+from Config import Config
+from Evaluator import Evaluator, makeEvaluator
+from MCTS import MCTS
+from Metrics import writePrometheus
 
 # Tuple of (Board, Player, Game) to simplify testing.
 BPGTuple = namedtuple('BPGTuple', 'board player game')
@@ -29,6 +49,13 @@ def init_board_from_array(board: Board, player):
     return BPGTuple(board, player, game)
 
 
+class UniformNet(Evaluator):
+    """Evaluates every board with a uniform policy and a value of 0."""
+
+    def predictStates(self, states):
+        return np.full((len(states), 7), 1 / 7), np.zeros(len(states))
+
+
 def test_simple_moves():
     board, player, game = init_board_from_moves([4, 5, 4, 3, 0, 6])
     expected = textwrap.dedent("""\
@@ -166,4 +193,726 @@ def test_immutable_move():
     new_np_pieces, new_player = game.getNextState(board, 3, -1)
 
     assert original_board_string == game.stringRepresentation(board)
-    assert original_board_string != game.stringRepresentation(new_np_pieces)
\ No newline at end of file
+    assert original_board_string != game.stringRepresentation(new_np_pieces)
+
+def test_canonical_form():
+    """Tests canonical form swaps the pieces of both players for player -1."""
+    board, player, game = init_board_from_moves([3, 3, 4])
+    assert (game.getCanonicalForm(board, 1).state == board.state).all()
+    assert (game.getCanonicalForm(board, -1).state == -board.state).all()
+
+
+def test_board_from_state():
+    """Tests a board built from its state array matches the original board."""
+    board, player, game = init_board_from_moves([3, 3, 4, 2, 6, 6, 6, 0])
+    copied = Board(board.state)
+    assert game.stringRepresentation(board) == game.stringRepresentation(copied)
+    assert (game.getValidMoves(board) == game.getValidMoves(copied)).all()
+
+    copied.move(1, 5)
+    assert game.stringRepresentation(board) != game.stringRepresentation(copied)
+
+
+def test_last_move_win():
+    """Tests wins made by the last move match a full board scan."""
+    moves_end_state_pairs = [
+        ([0, 6, 1, 6, 2, 6, 3], 1),  # horizontal
+        ([0, 1, 0, 1, 0, 1, 6, 1], -1),  # vertical
+        ([0, 1, 1, 2, 2, 3, 2, 3, 3, 6, 3], 1),  # diagonal
+        ([0, 1, 0, 1, 0, 1], 0),  # unfinished
+    ]
+
+    for moves, expected_win_value in moves_end_state_pairs:
+        board, player, game = init_board_from_moves(moves)
+        assert board.last_move == moves[-1]
+        assert board.move_count == len(moves)
+        assert expected_win_value == game.getWinState(board, 1)
+        assert expected_win_value == game.getWinState(Board(board.state), 1)
+
+
+def test_position_key():
+    """Tests position keys identify positions regardless of move order."""
+    board1, player1, game = init_board_from_moves([3, 4, 2, 4])
+    board2, player2, game = init_board_from_moves([2, 4, 3, 4])
+    board3, player3, game = init_board_from_moves([3, 4, 4, 2])
+
+    assert game.getPositionKey(board1) == game.getPositionKey(board2)
+    assert game.getPositionKey(board1) != game.getPositionKey(board3)
+    assert game.getPositionKey(board1) != game.getPositionKey(
+        game.getCanonicalForm(board1, -1))
+    assert game.getPositionKey(board1) == game.getPositionKey(Board(board1.state))
+
+
+def test_batch_game():
+    """Tests games played in lockstep match games played one by one."""
+    moves_list = [
+        [0, 6, 1, 6, 2, 6, 3],
+        [0, 1, 0, 1, 0, 1, 6, 1],
+        [0, 1, 2, 3, 4, 5, 6, 6, 6],
+        [3, 3, 4],
+    ]
+    batch_game = BatchGame(len(moves_list))
+    for ply in range(max(len(moves) for moves in moves_list)):
+        batch_game.step([moves[ply] if ply < len(moves) else -1 for moves in moves_list])
+
+    win_states = batch_game.getWinStates()
+    canonical_forms = batch_game.getCanonicalForms()
+    valid_moves = batch_game.getValidMoves()
+    for i, moves in enumerate(moves_list):
+        board, player, game = init_board_from_moves(moves)
+        assert game.getWinState(board, player) == win_states[i]
+        assert (game.getCanonicalForm(board, player).state == canonical_forms[i]).all()
+        assert (game.getValidMoves(board) == valid_moves[i]).all()
+        assert game.stringRepresentation(board) == game.stringRepresentation(batch_game.getBoard(i))
+
+
+def test_symmetric_form():
+    """Tests mirror images map to the same board."""
+    board1, player1, game = init_board_from_moves([0, 3, 1, 2])
+    board2, player2, game = init_board_from_moves([6, 3, 5, 4])
+
+    assert (board1.mirror().state == board2.state).all()
+    assert game.getPositionKey(board1.mirror()) == board1.getMirrorKey()
+    symmetric1, mirrored1 = game.getSymmetricForm(board1)
+    symmetric2, mirrored2 = game.getSymmetricForm(board2)
+    assert game.getPositionKey(symmetric1) == game.getPositionKey(symmetric2)
+    assert mirrored1 != mirrored2
+    assert game.getWinState(board1.mirror(), 1) == game.getWinState(board1, 1)
+
+
+def test_replay_buffer(tmp_path):
+    """Tests examples survive a round trip through shards and old shards are retired."""
+    board, player, game = init_board_from_moves([0, 3, 1])
+    pi = [0.25, 0, 0, 0.5, 0, 0, 0.25]
+    replay_buffer = ReplayBuffer(str(tmp_path), 2)
+    for iteration in range(3):
+        replay_buffer.add(iteration, game.getExamples([(board.state, pi, -1)] * (iteration + 1)))
+    assert replay_buffer.getIterations() == [1, 2]
+    assert len(replay_buffer) == 5
+
+    reopened = ReplayBuffer(str(tmp_path), 2)
+    reopened.open(last_iteration=1)
+    examples = reopened.getExamples()
+    assert examples.dtype == game.getExampleDtype()
+    assert len(examples) == 2
+    assert (examples['board'][0] == board.state).all()
+    assert (examples['pi'][0] == pi).all()
+    assert examples['v'][0] == -1
+
+
+def test_example_symmetries():
+    """Tests packed examples are mirrored like Game.getSymmetries."""
+    board, player, game = init_board_from_moves([0, 3, 1])
+    pi = np.array([0.25, 0, 0, 0.5, 0, 0.125, 0.125])
+    examples = game.getExampleSymmetries(game.getExamples([(board.state, pi, 1)]))
+    for example, (state, p) in zip(examples, game.getSymmetries(board, pi)):
+        assert (example['board'] == state).all()
+        assert (example['pi'] == p).all()
+        assert example['v'] == 1
+
+
+def test_conv2d():
+    """Tests the im2col convolution of NumpyNet against a direct sum with Keras 'same' padding."""
+    rng = np.random.RandomState(0)
+    x = rng.randn(2, 6, 7, 3)
+    for size in [1, 2, 3]:
+        kernel = rng.randn(size, size, 3, 4)
+        bias = rng.randn(4)
+        padded = np.zeros((2, 6 + size - 1, 7 + size - 1, 3))
+        top = (size - 1) // 2
+        padded[:, top:top + 6, top:top + 7] = x
+        expected = np.zeros((2, 6, 7, 4))
+        for i in range(6):
+            for j in range(7):
+                expected[:, i, j] = np.einsum('bklc,klcf->bf', padded[:, i:i + size, j:j + size], kernel) + bias
+        assert np.allclose(conv2d(x, kernel, bias), expected)
+
+
+def test_make_evaluator_config():
+    """Tests the NumPy and TFLite backends get the evaluation cache settings of the config they are made with."""
+    game = Game()
+    for filename in ['temp.npz', 'temp.tflite']:
+        config = Config()
+        config.evalCacheSize = 0
+        assert makeEvaluator(game, filename, config).cache is None
+        config.evalCacheSize, config.mirrorSymmetry = 10, True
+        nnet = makeEvaluator(game, filename, config)
+        assert nnet.cache is not None and nnet.config.mirrorSymmetry
+
+
+def test_engine_imports_without_tensorflow():
+    """Tests the engine modules do not import TensorFlow."""
+    code = "import sys, Board, Game, MCTS, Arena, SelfPlayWorkers; print('tensorflow' in sys.modules)"
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    assert result.stdout.strip() == 'False', result.stderr
+
+
+def test_solver():
+    """Tests the solver scores wins and losses by how early they happen."""
+    solver = Solver()
+    # player 1 to move wins in column 3 with its 4th piece
+    board, player, game = init_board_from_moves([0, 0, 1, 1, 2, 2])
+    canonical_board = game.getCanonicalForm(board, player)
+    assert solver.solve(canonical_board) == (6 * 7 + 1 - 6) // 2
+    assert solver.solve(canonical_board, weak=True) == 1
+
+    # player 2 to move cannot block both ends of the open three
+    board, player, game = init_board_from_moves([2, 2, 3, 3, 4])
+    canonical_board = game.getCanonicalForm(board, player)
+    assert solver.solve(canonical_board) == -((6 * 7 + 1 - 6) // 2)
+    assert solver.solve(canonical_board, weak=True) == -1
+
+    # one move left, which draws
+    board, player, game = init_board_from_moves(
+        [0, 1, 0, 1, 0, 1, 2, 3, 2, 3, 2, 3, 1, 0, 1, 0, 1, 0, 3, 2, 3, 2, 3, 2,
+         4, 5, 4, 5, 4, 5, 5, 4, 5, 4, 5, 4, 6, 6, 6, 6, 6])
+    canonical_board = game.getCanonicalForm(board, player)
+    assert game.getWinState(board, player) == 0
+    assert solver.solve(canonical_board) == 0
+    assert solver.getMoveScores(canonical_board) == [None] * 6 + [0]
+
+
+def test_opening_book(tmp_path):
+    """Tests book positions are found for both mirror images, and later positions are not."""
+    game = Game()
+
+    def policy(board):
+        # prefers the lowest valid column, so that mirror images differ
+        pi = np.zeros(game.getActionSize())
+        pi[np.argmax(game.getValidMoves(board))] = 1
+        return pi, 0.5
+
+    filepath = str(tmp_path / 'book.npy')
+    assert OpeningBook.build(game, 2, policy, filepath) == 1 + 4
+    book = OpeningBook(game, filepath)
+    board, player, game = init_board_from_moves([1])
+    mirror_board, mirror_player, game = init_board_from_moves([5])
+    pi, v = book.lookup(game.getCanonicalForm(board, player))
+    mirror_pi, mirror_v = book.lookup(game.getCanonicalForm(mirror_board, mirror_player))
+    assert (pi == mirror_pi[::-1]).all()
+    assert v == mirror_v == 0.5
+    board, player, game = init_board_from_moves([1, 1])
+    assert book.lookup(game.getCanonicalForm(board, player)) is None
+
+
+def test_build_opening_book_for_config(tmp_path):
+    """Tests a book can be built to the config.openingBook path, before that file exists."""
+    game = Game()
+    config = Config()
+    config.numMCTSSims = 10
+    config.openingBook = str(tmp_path / 'book.npy')
+    policy = searchPolicy(game, UniformNet(game, config), config)
+    assert OpeningBook.build(game, 2, policy, config.openingBook) == 1 + 4
+    assert config.openingBook is not None
+    assert OpeningBook(game, config.openingBook).lookup(game.getInitBoard()) is not None
+
+
+def test_mcts_max_nodes():
+    """Tests the node table never holds more than config.mctsMaxNodes nodes, and too small caps are refused."""
+    game = Game()
+    config = Config()
+    config.numMCTSSims = 60
+    config.mctsMaxNodes = 10
+    with pytest.raises(ValueError):
+        MCTS(game, UniformNet(game, config), config)
+
+    config.mctsMaxNodes = 61
+    mcts = MCTS(game, UniformNet(game, config), config)
+    board, player = game.getInitBoard(), 1
+    for action in [3, 3, 2, 4, 2]:
+        mcts.getActionProb(game.getCanonicalForm(board, player))
+        board, player = game.getNextState(board, player, action)
+    assert mcts.evictions > 0
+    assert mcts.getStats()['peakNodes'] <= 61
+
+
+def test_mcts_prune():
+    """Tests a new root drops the nodes it can not reach, and keeps its own subtree."""
+    game = Game()
+    config = Config()
+    config.numMCTSSims = 200
+    mcts = MCTS(game, UniformNet(game, config), config)
+    mcts.getActionProb(game.getInitBoard())
+    sibling = game.getCanonicalForm(game.getNextState(game.getInitBoard(), 1, 0)[0], -1)
+    board, player = game.getNextState(game.getInitBoard(), 1, 3)
+    root = game.getCanonicalForm(board, player)
+    grandchild = game.getCanonicalForm(game.getNextState(board, player, 3)[0], 1)
+    assert {mcts.getKey(sibling), mcts.getKey(root), mcts.getKey(grandchild)} <= set(mcts.nodes)
+
+    mcts.startSearch(root)
+    assert mcts.pruned > 0
+    assert mcts.getKey(sibling) not in mcts.nodes
+    assert mcts.getKey(game.getInitBoard()) not in mcts.nodes
+    assert mcts.getKey(root) in mcts.nodes and mcts.getKey(grandchild) in mcts.nodes
+    assert len(mcts.free) == mcts.pruned
+
+
+def test_mcts_evict():
+    """Tests eviction keeps the root, removes the least visited nodes first, and their rows are reused."""
+    game = Game()
+    config = Config()
+    config.numMCTSSims = 100
+    config.mctsMaxNodes = None
+    mcts = MCTS(game, UniformNet(game, config), config)
+    root = game.getInitBoard()
+    mcts.getActionProb(root)
+    s = mcts.getKey(root)
+    visits = {key: mcts.Ns[node] for key, node in mcts.nodes.items()}
+
+    mcts.evict(10, s)
+    assert len(mcts.nodes) == 10 and mcts.evictions == len(visits) - 10
+    assert s in mcts.nodes
+    kept = [visits[key] for key in mcts.nodes if key != s]
+    evicted = [visits[key] for key in visits if key not in mcts.nodes]
+    assert min(kept) >= max(evicted)
+
+    rows, free = mcts.rows, len(mcts.free)
+    for _ in range(5):
+        mcts.search(root)
+    assert mcts.rows == rows
+    assert len(mcts.free) == free - (len(mcts.nodes) - 10)
+
+
+def test_mcts_action_prob():
+    """Tests getActionProb gives the visit counts of the original dict based MCTS, over 6 plies of one tree."""
+    class LinearNet(Evaluator):
+        # a seeded random linear policy and value of the board cells
+        def __init__(self, game, config):
+            super().__init__(game, config)
+            rng = np.random.RandomState(0)
+            self.policy = rng.randn(42, 7) / 4
+            self.value = rng.randn(42) / 4
+
+        def predictStates(self, states):
+            x = np.asarray(states).reshape(len(states), 42)
+            logits = x @ self.policy
+            pis = np.exp(logits - logits.max(axis=1, keepdims=True))
+            return pis / pis.sum(axis=1, keepdims=True), np.tanh(x @ self.value)
+
+    game = Game()
+    config = Config()
+    config.numMCTSSims = 200
+    mcts = MCTS(game, LinearNet(game, config), config)
+    board, player = game.getInitBoard(), 1
+    # visit counts of the root, from the MCTS of the baseline commit
+    expected = [
+        [22, 21, 7, 120, 8, 5, 16],
+        [95, 98, 13, 17, 12, 22, 62],
+        [119, 16, 17, 13, 20, 5, 107],
+        [52, 12, 17, 30, 18, 10, 179],
+        [136, 41, 22, 51, 32, 4, 94],
+        [227, 10, 15, 22, 17, 40, 4],
+    ]
+    for counts in expected:
+        probs = mcts.getActionProb(game.getCanonicalForm(board, player))
+        assert np.allclose(probs, np.array(counts) / sum(counts))
+        board, player = game.getNextState(board, player, int(np.argmax(probs)))
+
+
+def test_batched_search():
+    """Tests batched MCTS runs exactly numMCTSSims iterations, with duplicate and terminal leaves in a batch."""
+    game = Game()
+    config = Config()
+    config.numMCTSSims = 100
+    config.mctsBatchSize = 8
+    nnet = UniformNet(game, config)
+
+    mcts = MCTS(game, nnet, config)
+    root, _ = mcts.startSearch(game.getInitBoard())
+    # the second path to the unexpanded root ends the batch
+    leaves, sims = mcts.selectLeaves(root, 8)
+    assert (len(leaves), sims) == (1, 1)
+    mcts.expandLeaves(leaves, *nnet.predictBatch(mcts.getLeafBoards(leaves)))
+    # the virtual losses spread the paths over the 7 children, the 8th path reaches one of them again
+    leaves, sims = mcts.selectLeaves(root, 8)
+    assert (len(leaves), sims) == (7, 7)
+    assert mcts.VLsa.sum() == 7 * config.virtualLoss
+    mcts.expandLeaves(leaves, *nnet.predictBatch(mcts.getLeafBoards(leaves)))
+    assert not mcts.VLsa.any()
+
+    # player 1 wins by playing column 0
+    board, player, game = init_board_from_moves([0, 1, 0, 1, 0, 1])
+    canonical_board = game.getCanonicalForm(board, player)
+    mcts = MCTS(game, nnet, config)
+    mcts.getActionProb(canonical_board)
+    node = mcts.nodes[mcts.getKey(canonical_board)]
+    # the first iteration expands the root instead of visiting it
+    assert mcts.Ns[node] == config.numMCTSSims - 1
+    visits = mcts.Ns[node]
+    mcts.getActionProb(canonical_board)
+    assert mcts.Ns[node] == visits + config.numMCTSSims
+    assert mcts.Nsa[node].sum() == mcts.Ns[node]
+    assert not mcts.VLsa.any()
+    assert mcts.getSearchStats()['terminalHits'] > 0
+    assert mcts.getSearchStats()['simulations'] == 2 * config.numMCTSSims
+
+
+def test_evaluation_cache(tmp_path):
+    """Tests cache hits and misses, LRU eviction, disabling the cache, and loading weights clearing it."""
+    game = Game()
+    config = Config()
+    config.evalCacheSize = 2
+    nnet = UniformNet(game, config)
+    boards = [init_board_from_moves([col]).board for col in range(3)]
+
+    nnet.predictBatch(boards[:2])
+    nnet.predict(boards[0])
+    assert (nnet.cacheHits, nnet.cacheMisses) == (1, 2)
+    # boards[1] is the least recently used, so boards[2] takes its place
+    nnet.predict(boards[2])
+    assert set(nnet.cache) == {game.getPositionKey(boards[0]), game.getPositionKey(boards[2])}
+    nnet.predict(boards[1])
+    assert (nnet.cacheHits, nnet.cacheMisses) == (1, 4)
+
+    program = {'input': 'board', 'outputs': ['pi', 'v'], 'ops': [
+        {'name': 'flat', 'inputs': ['board'], 'op': 'flatten'},
+        {'name': 'pi', 'inputs': ['flat'], 'op': 'dense', 'activation': 'softmax'},
+        {'name': 'v', 'inputs': ['flat'], 'op': 'dense', 'activation': 'tanh'},
+    ]}
+    np.savez(tmp_path / 'net.npz', program=np.array(json.dumps(program)),
+             **{'pi/kernel': np.zeros((42, 7)), 'pi/bias': np.zeros(7),
+                'v/kernel': np.zeros((42, 1)), 'v/bias': np.zeros(1)})
+    nnet = makeEvaluator(game, 'net.npz', config)
+    nnet.load_checkpoint(str(tmp_path), 'net.npz', suppress=True)
+    nnet.predictBatch(boards[:2])
+    assert len(nnet.cache) == 2
+    nnet.load_checkpoint(str(tmp_path), 'net.npz', suppress=True)
+    assert len(nnet.cache) == 0
+
+    config.evalCacheSize = 0
+    nnet = UniformNet(game, config)
+    nnet.predict(boards[0])
+    nnet.predict(boards[0])
+    assert nnet.cache is None and nnet.cacheMisses == 2
+
+
+def test_neural_net_load_clears_cache(tmp_path):
+    """Tests loading weights into a NeuralNet empties its evaluation cache."""
+    pytest.importorskip('tensorflow')
+    from NeuralNet import NeuralNet
+    config = Config()
+    config.num_channels = 4
+    config.num_residual_layers = 1
+    config.evalCacheSize = 10
+    nnet = NeuralNet(Game(), config)
+    nnet.save_checkpoint(str(tmp_path), 'net.pth.tar')
+    nnet.predict(Game().getInitBoard())
+    assert len(nnet.cache) == 1
+    nnet.load_checkpoint(str(tmp_path), 'net.pth.tar', suppress=True)
+    assert len(nnet.cache) == 0
+
+
+def test_neural_net_fast_predict():
+    """Tests the traced network matches the eager Keras model, and is traced once for all batch sizes and dtypes."""
+    pytest.importorskip('tensorflow')
+    from NeuralNet import NeuralNet
+    config = Config()
+    config.num_channels = 4
+    config.num_residual_layers = 1
+    nnet = NeuralNet(Game(), config)
+    rng = np.random.RandomState(0)
+    for size in [1, 8, 64]:
+        states = rng.randint(-1, 2, (size, 6, 7))
+        pis, vs = nnet.predictStates(states)
+        eager_pis, eager_vs = nnet.nnet.model(states.astype(np.float32), training=False)
+        assert isinstance(pis, np.ndarray) and isinstance(vs, np.ndarray)
+        assert np.allclose(pis, eager_pis, atol=1e-5)
+        assert np.allclose(vs, np.asarray(eager_vs)[:, 0], atol=1e-5)
+    # inputs are converted to float32 before the traced function sees them
+    nnet.predictStates(states.astype(np.float64))
+    nnet.predictStates(states.astype(np.int8))
+    assert nnet.fastPredict.experimental_get_tracing_count() == 1
+
+
+def test_batch_arena(monkeypatch):
+    """Tests lockstep arena games alternate the first player and end as sequential games with the same MCTS players."""
+    class ColumnNet(Evaluator):
+        # prefers the columns in order, and values boards by their top row
+        def __init__(self, game, config, order):
+            super().__init__(game, config)
+            pi = np.array([2. ** -order.index(col) for col in range(7)])
+            self.pi = pi / pi.sum()
+
+        def predictStates(self, states):
+            states = np.asarray(states)
+            return np.tile(self.pi, (len(states), 1)), states[:, 0].sum(axis=1) / 10
+
+    # ties between the most visited moves go to the first one, so the players are deterministic
+    monkeypatch.setattr(np.random, 'choice', lambda a, *args, **kwargs: a[0])
+    game = Game()
+    config = Config()
+    config.numMCTSSims = 10
+
+    def sequentialGames(nnet1, nnet2, num):
+        results = [0, 0, 0]
+        for swapped in [False] * (num // 2) + [True] * (num // 2):
+            # a new MCTS per player and game, as BatchArena does
+            players = [lambda x, mcts=MCTS(game, nnet, config): np.argmax(mcts.getActionProb(x, temp=0))
+                       for nnet in (nnet1, nnet2)]
+            result = Arena(*players[::-1], game).playGame() if swapped else Arena(*players, game).playGame()
+            result = -result if swapped else result
+            results[0 if result == 1 else 1 if result == -1 else 2] += 1
+        return tuple(results)
+
+    # with the same network, the player moving first wins
+    nnet = ColumnNet(game, config, [0, 1, 2, 3, 4, 5, 6])
+    assert BatchArena(nnet, nnet, game, config).playGames(6, disable_progress=True) == (3, 3, 0)
+    for batch_size in [1, 4]:
+        config.mctsBatchSize = batch_size
+        nnet1 = ColumnNet(game, config, [0, 1, 2, 3, 4, 5, 6])
+        nnet2 = ColumnNet(game, config, [1, 0, 2, 3, 4, 5, 6])
+        result = BatchArena(nnet1, nnet2, game, config).playGames(6, disable_progress=True)
+        assert sum(result) == 6
+        assert result == sequentialGames(nnet1, nnet2, 6)
+
+
+def columnPlayers(*steps):
+    """
+    Returns an arena player per step, playing the first valid column from
+    column move_count * step on. A step of 0 plays the lowest valid column.
+    """
+    def player(step):
+        def play(board):
+            columns = [(board.move_count * step + i) % 7 for i in range(7)]
+            return next(col for col in columns if board.getValidMoves()[col])
+        return play
+    return [player(step) for step in steps]
+
+
+def test_arena_async():
+    """Tests pooled arena games count every game, alternate the first player and end as in Arena.playGames."""
+    game = Game()
+    # the same player on both sides, so the player moving first wins
+    arena = Arena(*columnPlayers(0, 0), game)
+    assert arena.playGamesAsync(6, 2, columnPlayers, (0, 0), disable_progress=True) == (3, 3, 0)
+
+    # the lowest column player wins both as first and as second player
+    arena = Arena(*columnPlayers(1, 0), game)
+    result = arena.playGamesAsync(6, 2, columnPlayers, (1, 0), disable_progress=True)
+    assert result == arena.playGames(6, disable_progress=True) == (0, 6, 0)
+
+
+def test_micro_benchmark(monkeypatch):
+    """Tests the engine benchmarks run, and only a large enough change is a regression."""
+    monkeypatch.setattr(MicroBenchmark, 'repeats', 1)
+    monkeypatch.setattr(MicroBenchmark, 'min_time', 0.01)
+    results = MicroBenchmark.runBenchmarks(Game(), ['Board.move', 'Board.getWinValue'])
+    assert all(result['opsPerSec'] > 0 for result in results.values())
+
+    baseline = {name: dict(result) for name, result in results.items()}
+    assert MicroBenchmark.compareResults(results, baseline, 0.1) == []
+    baseline['Board.move']['opsPerSec'] = results['Board.move']['opsPerSec'] * 1.2
+    regressions = MicroBenchmark.compareResults(results, baseline, 0.1)
+    assert [regression[:2] for regression in regressions] == [('Board.move', 'opsPerSec')]
+
+
+def test_scaling_benchmark(tmp_path, monkeypatch):
+    """Tests the scaling harness runs the pipeline without and with 1 and 2 processes, and saves the table."""
+    class TrainedNet(UniformNet):
+        # trains, saves and loads nothing
+        def train(self, replayBuffer):
+            pass
+
+        def save_checkpoint(self, folder, filename):
+            pass
+
+        def load_checkpoint(self, folder, filename, suppress=False):
+            pass
+
+    # the coach, and the forked self-play and arena workers, use a TrainedNet
+    monkeypatch.setattr(ScalingBenchmark, 'makeNet', lambda game, config: TrainedNet(game, config))
+    monkeypatch.setattr('SelfPlayWorkers.makeEvaluator', lambda game, filename, config: TrainedNet(game, config))
+    monkeypatch.setattr('Arena.makeEvaluator', lambda game, filename, config: TrainedNet(game, config))
+    monkeypatch.setattr(ScalingBenchmark, 'processes_counts', [1, 2])
+    monkeypatch.setattr(ScalingBenchmark, 'iterations', 2)
+    monkeypatch.setattr(ScalingBenchmark, 'results_file', str(tmp_path / 'temp' / 'scaling.json'))
+    monkeypatch.setattr(os, 'cpu_count', lambda: 2)
+    rows = ScalingBenchmark.runScaling()
+    assert [row['workers'] for row in rows] == ['sequential', '1 processes', '2 processes']
+    for row in rows:
+        assert row['gamesPerHour'] > 0 and row['positionsPerSec'] > 0 and row['evaluationsPerSec'] > 0
+        assert row['iterationTime'] >= row['selfPlayTime'] > 0
+    with open(tmp_path / 'temp' / 'scaling.json') as f:
+        results = json.load(f)
+    assert results['cpus'] == 2
+    assert [run['processes'] for run in results['runs']] == [1, 1, 2]
+
+
+def test_search_metrics(tmp_path):
+    """Tests every MCTS iteration either expands a board or ends on a terminal one, and the metrics export."""
+    config = Config()
+    config.numMCTSSims = 100
+    game = Game()
+    nnet = UniformNet(game, config)
+    mcts = MCTS(game, nnet, config)
+    # player 1 wins by playing column 0
+    board, player, game = init_board_from_moves([0, 1, 0, 1, 0, 1])
+    mcts.getActionProb(game.getCanonicalForm(board, player))
+    stats = mcts.getSearchStats()
+    assert stats['simulations'] == 100
+    assert stats['expansions'] + stats['terminalHits'] == 100
+    assert stats['terminalHits'] > 0
+    inference = nnet.getInferenceStats()
+    assert inference['networkCalls'] == nnet.cacheMisses == stats['expansions']
+    assert inference['latencyCounts'].sum() == inference['networkCalls']
+
+    filepath = str(tmp_path / 'metrics.prom')
+    totals = dict(stats, **inference)
+    writePrometheus(filepath, {'iteration': 1, 'trainTime': 2.5}, totals)
+    lines = open(filepath).read().splitlines()
+    assert 'c4_iteration 1.0' in lines
+    assert 'c4_iteration_phase_seconds{phase="train"} 2.5' in lines
+    assert f'c4_mcts_simulations_total {100.0}' in lines
+    assert f'c4_nn_latency_seconds_count {float(stats["expansions"])}' in lines
+
+
+def test_self_play_workers(tmp_path, monkeypatch):
+    """Tests self-play workers outlive an iteration, build their network once and load it once per generation."""
+    class LoggedNet(UniformNet):
+        # appends the process id of every build and load to tmp_path/log
+        def __init__(self, game, config):
+            super().__init__(game, config)
+            self.log('build')
+
+        def log(self, event):
+            with open(tmp_path / 'log', 'a') as f:
+                f.write(f'{os.getpid()} {event}\n')
+
+        def load_checkpoint(self, folder, filename, suppress=False):
+            self.log('load')
+
+    class PublishedNet():
+        def save_checkpoint(self, folder, filename):
+            pass
+
+    config = Config()
+    config.checkpoint = str(tmp_path)
+    config.processes = 2
+    config.numMCTSSims = 2
+    # the forked workers build a LoggedNet instead of the network of temp.pth.tar
+    monkeypatch.setattr('SelfPlayWorkers.makeEvaluator', lambda *args: LoggedNet(Game(), config))
+    workers = SelfPlayWorkers(config)
+    workers.publish(PublishedNet(), 0)
+    pids = [worker.pid for worker in workers.workers]
+    assert len(list(workers.playEpisodes(4))) == 4
+    workers.publish(PublishedNet(), 1)
+    assert len(list(workers.playEpisodes(4))) == 4
+    assert [worker.pid for worker in workers.workers] == pids
+    workers.stop()
+
+    events = [tuple(line.split()) for line in open(tmp_path / 'log').read().splitlines()]
+    assert {int(pid) for pid, _ in events} <= set(pids)
+    for pid in pids:
+        # a worker may miss the episodes of a generation
+        loads = events.count((str(pid), 'load'))
+        assert events.count((str(pid), 'build')) == min(loads, 1) and loads <= 2
+    assert 2 <= sum(event == 'load' for _, event in events) <= 4
+
+
+def test_self_play_worker_errors(tmp_path):
+    """Tests a failing or dying self-play worker raises in the parent instead of blocking it."""
+    class MissingNet():
+        # publishes nothing, so the workers do not find temp.npz
+        def save_checkpoint(self, folder, filename):
+            pass
+
+        def export_checkpoint(self, folder, filename):
+            pass
+
+    config = Config()
+    config.checkpoint = str(tmp_path)
+    config.processes = 1
+    config.numpyInference = True
+    workers = SelfPlayWorkers(config)
+    workers.publish(MissingNet(), 0)
+    with pytest.raises(WorkerError, match='temp.npz'):
+        next(workers.playEpisodes(1))
+    workers.workers[0].join()
+
+    workers = SelfPlayWorkers(config)
+    workers.publish(MissingNet(), 0)
+    workers.workers[0].kill()
+    with pytest.raises(WorkerError, match='exited'):
+        workers.getResult(poll=0.1)
+
+
+class ServedNet(UniformNet):
+    """Values every board by its number of pieces, and has no weights to load."""
+
+    def load_checkpoint(self, folder, filename, suppress=False):
+        pass
+
+    def predictStates(self, states):
+        pis, _ = super().predictStates(states)
+        return pis, np.abs(states).sum(axis=(1, 2))
+
+
+def test_inference_server(tmp_path, monkeypatch):
+    """Tests the inference server evaluates the requests of all clients together and answers each with its boards."""
+    config = Config()
+    config.checkpoint = str(tmp_path)
+    config.inferenceMaxWait = 10.
+    # the forked server builds a ServedNet instead of the network of temp.pth.tar
+    monkeypatch.setattr('InferenceServer.makeEvaluator', lambda *args: ServedNet(Game(), config))
+    server = InferenceServer(config, 2)
+    server.start()
+    clients = [InferenceClient(client_id, server.requests, server.responses) for client_id in range(2)]
+    counts = [[1, 2, 3], [10, 11]]
+    boards = [[init_board_from_moves([i % 7 for i in range(n)]).board for n in client_counts]
+              for client_counts in counts]
+    # the batch is only full once both clients sent their boards
+    with ThreadPool(2) as pool:
+        results = pool.map(lambda i: clients[i].predictBatch(boards[i]), range(2))
+    for client_counts, (pis, vs) in zip(counts, results):
+        assert pis.shape == (len(client_counts), 7)
+        assert vs.tolist() == client_counts
+    stats = server.getStats()
+    assert (stats['networkCalls'], stats['cacheMisses']) == (1, 5)
+    assert server.getStats()['networkCalls'] == 0
+    server.stop()
+
+
+def test_self_play_inference_server(tmp_path, monkeypatch):
+    """Tests self-play workers evaluating on the inference server, and the server stats of their episodes."""
+    class PublishedNet():
+        def save_checkpoint(self, folder, filename):
+            pass
+
+    config = Config()
+    config.checkpoint = str(tmp_path)
+    config.processes = 2
+    config.numMCTSSims = 5
+    config.inferenceServer = True
+    monkeypatch.setattr('InferenceServer.makeEvaluator', lambda *args: ServedNet(Game(), config))
+    workers = SelfPlayWorkers(config)
+    workers.publish(PublishedNet(), 0)
+    infos = [info for _, info in workers.playEpisodes(4)]
+    stats = workers.inferenceServer.getStats()
+    workers.stop()
+    # the workers have no evaluation cache, every board they expand goes to the server
+    assert stats['cacheMisses'] == sum(info['expansions'] for info in infos)
+    assert 0 < stats['networkCalls'] <= stats['cacheMisses']
+    assert stats['latencyCounts'].sum() == stats['networkCalls']
+
+
+def test_inference_server_control_requests(tmp_path, monkeypatch):
+    """Tests reload, stats and stop requests taken while a batch is filling wait until it is answered."""
+    config = Config()
+    config.checkpoint = str(tmp_path)
+    config.inferenceMaxWait = 10.
+    monkeypatch.setattr('InferenceServer.makeEvaluator', lambda *args: ServedNet(Game(), config))
+    server = InferenceServer(config, 2)
+    server.start()
+    states = np.asarray([init_board_from_moves([3]).board.state])
+    # the batch waits for the second client, so the next request arrives while it is filling
+    server.requests.put((0, states))
+    server.reload()
+    assert server.responses[0].get()[1].tolist() == [1]
+    server.requests.put((0, states))
+    stats = server.getStats()
+    assert (stats['networkCalls'], stats['cacheMisses']) == (2, 2)
+    assert server.responses[0].get()[1].tolist() == [1]
+    server.requests.put((0, states))
+    server.stop()
+    assert server.responses[0].get()[1].tolist() == [1]